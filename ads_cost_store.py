@@ -0,0 +1,121 @@
+import datetime as dt
+import hashlib
+import os
+import tempfile
+import threading
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import streamlit as st
+from datasources import get_backend
+from query_executor import DATAFRAME
+
+# Local copy of the daily ads cost rows, one parquet file per platform:
+#
+#   <store_dir>/<backend>/<platform>.parquet
+#
+# Rows are keyed by (platform, campaign_id, segment_date).  A refresh only asks
+# BigQuery for segment dates on or after the stored watermark (the newest
+# segment_date) minus a look-back window, since spend for recent days is still
+# restated after it is first reported.  The rows it returns replace every
+# stored row in that window; older rows are kept as they are.  So the data
+# scanned per refresh covers the window, not the whole campaign history.
+#
+# The first refresh, or one after start_date or a query changed, loads
+# everything from start_date.  Delete the store directory to force a full reload.
+
+STORE_DIR_ENV = "CL_ADS_STORE_DIR"
+DEFAULT_STORE_DIR = os.path.join(".cache", "ads_costs")
+LOOKBACK_ENV = "CL_ADS_LOOKBACK_DAYS"
+DEFAULT_LOOKBACK_DAYS = 7
+
+DATE_COLUMN = "segment_date"
+
+
+class AdsCostStore:
+    def __init__(self, directory, start_date, lookback_days=DEFAULT_LOOKBACK_DAYS):
+        self.directory = directory
+        self.start_date = dt.date.fromisoformat(str(start_date))
+        self.lookback_days = lookback_days
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, platform):
+        return os.path.join(self.directory, f"{platform}.parquet")
+
+    def read(self, platform, query):
+        """
+        Stored rows for platform as an Arrow table, None if there are none or
+        they were loaded by another query or from another start_date.
+        """
+        try:
+            table = pq.read_table(self.path(platform))
+        except FileNotFoundError:
+            return None
+        metadata = table.schema.metadata or {}
+        if metadata.get(b"start_date") != self.start_date.isoformat().encode() \
+                or metadata.get(b"query") != query.encode():
+            return None
+        return table
+
+    def since(self, stored):
+        """First segment date a refresh has to query, given the stored rows."""
+        if stored is None or stored.num_rows == 0:
+            return self.start_date
+        watermark = pc.max(stored.column(DATE_COLUMN)).as_py()
+        if isinstance(watermark, dt.datetime):
+            watermark = watermark.date()
+        return max(self.start_date, watermark - dt.timedelta(days=self.lookback_days))
+
+    def refresh(self, queries, executor):
+        """
+        Bring every platform up to date and return {platform: DataFrame} of all
+        its rows.  queries maps platform -> function(since_date) returning the
+        SQL for the rows on or after since_date; they run concurrently.
+        """
+        with self._lock:
+            fingerprints = {platform: hashlib.sha1(sql_for(self.start_date).encode()).hexdigest()
+                            for platform, sql_for in queries.items()}
+            stored = {platform: self.read(platform, fingerprints[platform]) for platform in queries}
+            since = {platform: self.since(stored[platform]) for platform in queries}
+            jobs = {platform: executor.submit(sql_for(since[platform]), DATAFRAME)
+                    for platform, sql_for in queries.items()}
+            return {platform: self._upsert(platform, fingerprints[platform], stored[platform],
+                                           since[platform], job.result())
+                    for platform, job in jobs.items()}
+
+    def _upsert(self, platform, query, stored, since, fresh):
+        table = pa.Table.from_pandas(fresh, preserve_index=False)
+        if stored is not None:
+            # Newest rows first, as the queries return them
+            dates = stored.column(DATE_COLUMN)
+            kept = stored.filter(pc.less(dates, pa.scalar(since).cast(dates.type)))
+            table = pa.concat_tables([table, kept.cast(table.schema)], promote_options="default") \
+                if table.num_rows else kept
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"query": query.encode(),
+            b"start_date": self.start_date.isoformat().encode(),
+            b"refreshed": dt.datetime.now(dt.timezone.utc).isoformat().encode(),
+            b"since": since.isoformat().encode(),
+        })
+
+        # A temporary file of its own, so two processes refreshing the same store
+        # never write into one another's file before it replaces the stored one
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f".{platform}.", suffix=".parquet.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pq.write_table(table, f)
+            os.replace(tmp, self.path(platform))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return table.to_pandas()
+
+
+@st.cache_resource
+def get_ads_cost_store(start_date):
+    """Process-wide AdsCostStore for the configured backend."""
+    directory = os.path.join(os.environ.get(STORE_DIR_ENV, DEFAULT_STORE_DIR), get_backend())
+    lookback_days = int(os.environ.get(LOOKBACK_ENV, DEFAULT_LOOKBACK_DAYS))
+    return AdsCostStore(directory, start_date, lookback_days)
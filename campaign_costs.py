@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+# Date-range campaign spend from df_campaigns_all without filtering it.
+#
+# Built once per refresh (settings.build_campaign_frames): the daily rows sorted
+# by (campaign, segment day), with
+#   - running totals of cost (in integer micros, so range sums are exact) and
+#     of rows / rows with a cost, so a campaign's spend over a range is the
+#     difference of two running totals
+#   - per row, the position of the newest row at or before it with a
+#     campaign_name / country / app_language, so the newest values in a range
+#     are one lookup at its last row
+#
+# A date range is then two searchsorted calls over every campaign at once and
+# a few gathers, whatever the number of campaign days.  rollup() returns what
+# campaigns.rollup_campaign_data returns for the rows in the range.
+
+DIMENSIONS = ["campaign_name", "country", "app_language"]
+MICROS = 1_000_000
+
+
+def _day_numbers(values):
+    """Days since epoch as int64, NaT as the int64 minimum."""
+    days = pd.to_datetime(values).to_numpy().astype("datetime64[D]")
+    return days.astype(np.int64)
+
+
+def _newest_valid(valid, first_row):
+    """
+    For each row, the position of the last row at or before it (within its
+    campaign) where valid is True, -1 if there is none.
+    """
+    positions = np.where(valid, np.arange(len(valid)), -1)
+    positions = np.maximum.accumulate(positions) if len(positions) else positions
+    return np.where(positions >= first_row, positions, -1)
+
+
+class CampaignCostIndex:
+    def __init__(self, df_campaigns_all):
+        days = _day_numbers(df_campaigns_all["segment_date"])
+        dated = days != np.iinfo(np.int64).min
+        df = df_campaigns_all.loc[dated]
+
+        codes, self.campaign_ids = pd.factorize(df["campaign_id"])
+        order = np.lexsort((days[dated], codes))
+        self.codes = codes[order]
+        self.days = days[dated][order]
+        n_campaigns = len(self.campaign_ids)
+
+        # (campaign, day) as one sortable key
+        self.day_offset = int(self.days.min()) if len(self.days) else 0
+        self.span = int(self.days.max()) - self.day_offset + 2 if len(self.days) else 1
+        self.keys = self.codes.astype(np.int64) * self.span + (self.days - self.day_offset)
+
+        cost = df["cost"].to_numpy(dtype=np.float64)[order]
+        has_cost = ~np.isnan(cost)
+        micros = np.where(has_cost, np.rint(cost * MICROS), 0).astype(np.int64)
+        self.cost_micros = np.concatenate([[0], np.cumsum(micros)])
+        self.cost_rows = np.concatenate([[0], np.cumsum(has_cost)])
+
+        first_row = np.searchsorted(self.codes, np.arange(n_campaigns))[self.codes]
+        self.values = {}
+        self.newest = {}
+        for col in DIMENSIONS:
+            values = df[col].to_numpy(dtype=object)[order]
+            self.values[col] = values
+            self.newest[col] = _newest_valid(pd.notna(values), first_row)
+
+    def _bounds(self, daterange):
+        lo, hi = (int(_day_numbers(pd.Series([d]))[0]) - self.day_offset for d in daterange)
+        # Clip into the key space so ranges outside the data stay empty
+        lo = min(max(lo, 0), self.span - 1)
+        hi = max(min(hi, self.span - 2), -1)
+        campaigns = np.arange(len(self.campaign_ids), dtype=np.int64) * self.span
+        start = np.searchsorted(self.keys, campaigns + lo, side="left")
+        end = np.searchsorted(self.keys, campaigns + hi, side="right") if hi >= 0 else start
+        return start, np.maximum(start, end)
+
+    def rollup(self, daterange):
+        """
+        One row per campaign with spend in daterange (inclusive): campaign_id,
+        campaign_name, cost, country, app_language, the names and dimensions
+        being the newest ones in the range.
+        """
+        start, end = self._bounds(daterange)
+        present = np.flatnonzero(end > start)
+        start, end = start[present], end[present]
+
+        rows = end - start
+        cost = (self.cost_micros[end] - self.cost_micros[start]) / MICROS
+        # A single day without a cost stays missing, as a single row does
+        # in rollup_campaign_data; several are summed skipping missing costs
+        cost[(rows == 1) & (self.cost_rows[end] == self.cost_rows[start])] = np.nan
+
+        columns = {"campaign_id": self.campaign_ids[present]}
+        last = end - 1
+        for col in DIMENSIONS:
+            newest = self.newest[col][last]
+            values = np.full(len(present), None, dtype=object)
+            found = newest >= start
+            values[found] = self.values[col][newest[found]]
+            columns[col] = values
+        columns["cost"] = cost
+        return pd.DataFrame(columns)[["campaign_id", "campaign_name", "cost", "country", "app_language"]]
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Campaign lookups for the home page selectors and Data Table, built once per
+# (user data version, campaign data version) instead of on every rerun:
+#
+#   - one row per campaign_id seen in the user frames or the marketing data,
+#     sorted by display name: its marketing campaign_name when tracked,
+#     "<campaign_id> (Untracked)" for ids only the user data has, the dropdown
+#     label and the campaign's marketing country / app_language and first
+#     user source_id
+#   - source_id -> positions of the campaigns seen with it in either user
+#     frame, in display order (ties by campaign_id), so a source's dropdown
+#     is one gather
+#
+# enrich() fills the Data Table's campaign columns with per-campaign lookups
+# into the dimension and a date range's rollup.
+
+UNTRACKED_SUFFIX = " (Untracked)"
+ALL_SOURCES = None
+
+
+def _source_campaign_pairs(frame):
+    """Distinct (source_id, campaign_id) of a user frame, with a campaign."""
+    pairs = frame[["source_id", "campaign_id"]].drop_duplicates()
+    pairs = pairs[pairs["campaign_id"].notna()]
+    return pairs.astype(object)
+
+
+class CampaignDimension:
+    def __init__(self, user_dataset, df_campaigns_rollup):
+        app_launch = user_dataset.campaign_users_app_launch
+        progress = user_dataset.campaign_users_progress
+
+        # Source dropdown: the sources of the app launch users
+        self.source_ids = sorted(app_launch["source_id"].dropna().unique())
+
+        pairs = pd.concat([_source_campaign_pairs(app_launch), _source_campaign_pairs(progress)],
+                          ignore_index=True).drop_duplicates()
+        user_campaign_ids = pairs["campaign_id"].drop_duplicates()
+
+        tracked = df_campaigns_rollup[["campaign_id", "campaign_name", "country", "app_language"]]
+        tracked = tracked.drop_duplicates(subset=["campaign_id"], keep="first").assign(tracked=True)
+        untracked_ids = user_campaign_ids[~user_campaign_ids.isin(tracked["campaign_id"])]
+        untracked = pd.DataFrame({
+            "campaign_id": untracked_ids.to_numpy(dtype=object),
+            "display_name": untracked_ids.astype(str).to_numpy(dtype=object) + UNTRACKED_SUFFIX,
+            "tracked": False,
+        })
+
+        campaigns = pd.concat([tracked.assign(display_name=tracked["campaign_name"]), untracked],
+                              ignore_index=True)
+        campaigns = campaigns.sort_values(["display_name", "campaign_id"], ignore_index=True)
+        first_source = pairs.dropna(subset=["source_id"]).drop_duplicates("campaign_id")
+        campaigns["source_id"] = campaigns["campaign_id"].map(
+            first_source.set_index("campaign_id")["source_id"])
+        campaigns["label"] = [f"{name} ({campaign_id})" for name, campaign_id
+                              in zip(campaigns["display_name"], campaigns["campaign_id"])]
+        self.campaigns = campaigns.set_index("campaign_id")
+        self.labels = campaigns["label"].to_numpy(dtype=object)
+        self.campaign_ids = campaigns["campaign_id"].to_numpy(dtype=object)
+
+        positions = self.campaigns.index.get_indexer(pairs["campaign_id"])
+        self.source_positions = {ALL_SOURCES: np.unique(positions)}
+        for source_id, rows in pairs.groupby("source_id", sort=False).indices.items():
+            self.source_positions[source_id] = np.unique(positions[rows])
+
+    def options(self, source_id=ALL_SOURCES):
+        """(labels, {label: campaign_id}) for the campaigns of source_id, in display order."""
+        positions = self.source_positions.get(source_id, np.empty(0, dtype=np.intp))
+        labels = self.labels[positions].tolist()
+        return labels, dict(zip(labels, self.campaign_ids[positions]))
+
+    def enrich(self, df_users_filtered, df_range_rollup):
+        """
+        The Data Table from the per-campaign user counts: campaign_name, cost
+        and missing country / app_language filled from the campaign's spend in
+        the range, then its marketing name, then its campaign_id.
+        """
+        ids = df_users_filtered["campaign_id"]
+        in_range = df_range_rollup.set_index("campaign_id")
+        rows = in_range.index.get_indexer(ids)
+        found = rows >= 0
+
+        def from_range(col, dtype=object):
+            values = np.full(len(ids), np.nan, dtype=dtype)
+            values[found] = in_range[col].to_numpy(dtype=dtype)[rows[found]]
+            return values
+
+        def fill(values, fallback):
+            # Object arrays rather than Series.fillna / combine_first, which
+            # warn when filling categoricals or downcasting object columns
+            values = np.asarray(values, dtype=object)
+            return np.where(pd.isna(values), fallback, values)
+
+        tracked_names = self.campaigns.loc[self.campaigns["tracked"].astype(bool), "campaign_name"]
+        campaign_name = fill(from_range("campaign_name"), ids.map(tracked_names).to_numpy(dtype=object))
+        campaign_name = fill(campaign_name, ids.to_numpy(dtype=object))
+
+        return df_users_filtered.assign(
+            campaign_id=ids.to_numpy(dtype=object),
+            country=fill(df_users_filtered["country"], from_range("country")),
+            app_language=fill(df_users_filtered["app_language"], from_range("app_language")),
+            campaign_name=campaign_name,
+            cost=from_range("cost", np.float64),
+        )
+
+
+@st.cache_resource(max_entries=2)
+def get_campaign_dimension(user_version, campaign_version, _user_dataset, _campaign_data):
+    """CampaignDimension for one user data version and one campaign data version."""
+    return CampaignDimension(_user_dataset, _campaign_data.df_campaigns_rollup)
@@ -1,27 +1,34 @@
 import streamlit as st
 import pandas as pd
-from rich import print as print
-import asyncio
-from pyinstrument import Profiler
-from settings import get_gcp_credentials
+import numpy as np
+from dataclasses import dataclass
+from ads_cost_store import get_ads_cost_store
+from campaign_costs import CampaignCostIndex
+from query_executor import get_query_executor
+import telemetry
+from versioned_cache import versioned_cache
 
 #Event data started getting the campaign metadata in production on this date
 start_date = '2024-11-08'
 
 # Proper UTM parameter data was implemented on the marketing side and in the CR production 
 
-async def get_campaign_data():
-    p = Profiler(async_mode="disabled")
-    with p:
-        _, bq_client = get_gcp_credentials()
 
-        # Helper function to run BigQuery queries asynchronously
-        async def run_query(query):
-            return await asyncio.to_thread(bq_client.query(query).to_dataframe)
+@dataclass(frozen=True)
+class CampaignData:
+    """
+    The marketing campaign frames, built once per refresh and shared by every
+    session.  Treat the frames as read-only.
+    """
+    version: str
+    df_campaigns_all: pd.DataFrame
+    df_campaigns_rollup: pd.DataFrame
+    cost_index: CampaignCostIndex  # spend for any date range
 
 
-        # Google Ads Query
-        google_ads_query = f"""
+# Google Ads Query
+def google_ads_query(since=start_date):
+    return f"""
             SELECT
                 distinct metrics.campaign_id,
                 metrics.segments_date as segment_date,
@@ -30,42 +37,84 @@ async def get_campaign_data():
             FROM dataexploration-193817.marketing_data.p_ads_CampaignStats_6687569935 as metrics
             INNER JOIN dataexploration-193817.marketing_data.ads_Campaign_6687569935 as campaigns
             ON metrics.campaign_id = campaigns.campaign_id
-            AND metrics.segments_date >= '{start_date}'
+            AND metrics.segments_date >= '{since}'
 
         """
 
-        # Facebook Ads Query
-        facebook_ads_query = f"""
+
+# Facebook Ads Query
+def facebook_ads_query(since=start_date):
+    return f"""
             SELECT 
                 d.campaign_id,
                 d.data_date_start as segment_date,
                 d.campaign_name,
                 d.spend as cost
             FROM dataexploration-193817.marketing_data.facebook_ads_data as d
-            WHERE d.data_date_start >= '{start_date}'
+            WHERE d.data_date_start >= '{since}'
             ORDER BY d.data_date_start DESC;
         """
 
-        # Run both queries concurrently using asyncio.gather
-        google_ads_data, facebook_ads_data = await asyncio.gather(
 
-            run_query(google_ads_query),
-            run_query(facebook_ads_query)
+def get_campaign_data():
+    # Only segment dates from the stored watermark (less the look-back
+    # window) are queried, both platforms concurrently; see ads_cost_store.py
+    with telemetry.stage("campaigns.ads_refresh"):
+        ads_data = get_ads_cost_store(start_date).refresh(
+            {"google": google_ads_query, "facebook": facebook_ads_query},
+            get_query_executor(),
         )
+    google_ads_data = ads_data["google"]
+    facebook_ads_data = ads_data["facebook"]
 
-        # Process Google Ads Data
+    # Process Google Ads Data
+    with telemetry.stage("campaigns.google_ads_cleanup"):
         google_ads_data["campaign_id"] = google_ads_data["campaign_id"].astype(str).str.replace(",", "")
         google_ads_data["cost"] = google_ads_data["cost"].divide(1000000).round(2)
         google_ads_data["segment_date"] = pd.to_datetime(google_ads_data["segment_date"])
 
- 
-    p.print(color="red")
+    # data_date_start is a TIMESTAMP and arrives UTC-aware; as naive dates it
+    # concatenates with the google segment dates into one datetime64 column
+    facebook_ads_data["segment_date"] = pd.to_datetime(
+        facebook_ads_data["segment_date"], utc=True).dt.tz_localize(None).dt.normalize()
+
     return  google_ads_data, facebook_ads_data
 
-@st.cache_data(ttl="1d", show_spinner=False)
+@st.cache_resource
+def get_parsed_campaign_names():
+    """
+    campaign_name -> (country, app_language) for every name parsed so far in
+    this process.  Kept across refreshes, so only new names are parsed.
+    """
+    return {}
+
+
+@versioned_cache(enabled=False)  # runs once per settings.build_campaign_frames
+def add_country_and_language(df):
+    # Each campaign name repeats once per day of spend; parse each distinct
+    # name once and map the results back to the rows by code
+    codes, names = pd.factorize(df["campaign_name"], use_na_sentinel=False)
+    parsed = get_parsed_campaign_names()
+
+    new = [name for name in names if isinstance(name, str) and name not in parsed]
+    if new:
+        countries, languages = parse_campaign_names(pd.Series(new, dtype=object))
+        parsed.update(zip(new, zip(countries, languages)))
+
+    # A missing name has neither
+    countries = np.empty(len(names), dtype=object)
+    languages = np.empty(len(names), dtype=object)
+    for i, name in enumerate(names):
+        if isinstance(name, str):
+            countries[i], languages[i] = parsed[name]
+
+    return df.assign(country=countries[codes], app_language=languages[codes])
+
+
 # Looks for the string following the dash and makes that the associated country.
 # This requires a strict naming convention of "[anything without dashes] - [country]]"
-def add_country_and_language(df):
+def parse_campaign_names(campaign_names):
+    """(country, app_language) Series parsed from a Series of campaign names."""
 
     # Define the regex patterns
     country_regex_pattern = r"-\s*(.*)"
@@ -73,37 +122,33 @@ def add_country_and_language(df):
     campaign_regex_pattern = r"\s*(.*)Campaign"
 
     # Extract the country
-    df["country"] = (
-        df["campaign_name"].str.extract(country_regex_pattern)[0].str.strip()
-    )
+    country = campaign_names.str.extract(country_regex_pattern)[0].str.strip()
 
     # Remove the word "Campaign" if it exists in the country field
-    extracted = df["country"].str.extract(campaign_regex_pattern)
-    df["country"] = extracted[0].fillna(df["country"]).str.strip()
+    extracted = country.str.extract(campaign_regex_pattern)
+    country = extracted[0].fillna(country).str.strip()
 
     # Extract the language
-    df["app_language"] = (
-        df["campaign_name"].str.extract(language_regex_pattern)[0].str.strip()
-    )
+    app_language = campaign_names.str.extract(language_regex_pattern)[0].str.strip()
 
     # Set default values to None where there's no match
     country_contains_pattern = r"-\s*(?:.*)"
     language_contains_pattern = r":\s*(?:[^-]+?)\s*-"
 
-    df["country"] = df["country"].where(
-        df["campaign_name"].str.contains(
+    country = country.where(
+        campaign_names.str.contains(
             country_contains_pattern, regex=True, na=False
         ),
         None,
     )
-    df["app_language"] = df["app_language"].where(
-        df["campaign_name"].str.contains(
+    app_language = app_language.where(
+        campaign_names.str.contains(
             language_contains_pattern, regex=True, na=False
         ),
         None,
     ).str.lower()
 
-    return df
+    return country, app_language
 
 
 # This function takes a campaign based dataframe and sums it up into a single row per campaign.  The original dataframe
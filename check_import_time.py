@@ -0,0 +1,119 @@
+"""
+Measure what the Streamlit entry points cost to import, with `python -X
+importtime`, and fail when it goes over budget.
+
+For each entry point the script collects its module-level import statements
+(without running the page itself) and imports them in a fresh interpreter,
+--repeat times, keeping the fastest run.  It reports the total import time and
+the slowest top-level modules, and fails (exit status 1) when:
+
+  - the total is over --budget-ms (CL_IMPORT_BUDGET_MS, default 2000), or
+  - a module that should only be loaded on the code path that needs it
+    (DEFERRED) is imported at start, e.g. the Google Cloud clients, which
+    only the gcs backend uses
+
+    python check_import_time.py
+    python check_import_time.py --budget-ms 1500 --top 20 home.py
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ENTRY_POINTS = ["main.py", "home.py", "warmup.py"]
+BUDGET_ENV = "CL_IMPORT_BUDGET_MS"
+DEFAULT_BUDGET_MS = 2000
+
+# Imported inside the functions that use them
+DEFERRED = [
+    "gcsfs",
+    "google.cloud.bigquery",
+    "google.cloud.bigquery_storage",
+    "google.cloud.secretmanager",
+    "google.oauth2.service_account",
+    "streamlit_option_menu",
+    "opentelemetry.sdk",
+    "sklearn",
+    "scipy",
+    "ibis",
+    "plost",
+    "pyinstrument",
+]
+
+
+def import_statements(path):
+    """The module-level import statements of a script, as source."""
+    with open(path) as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return "\n".join(ast.get_source_segment(source, node) for node in tree.body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def measure(code):
+    """
+    [(self_us, cumulative_us, depth, module)] in import order for code run in
+    a fresh interpreter.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return imports
+
+
+def deferred_imported(imports):
+    modules = {name for _, _, _, name in imports}
+    return [module for module in DEFERRED if module in modules]
+
+
+def report(entry_point, imports, budget_ms, top, startup=()):
+    """
+    Print the report for one entry point; True if it is within budget.  The
+    startup modules (those any interpreter imports) are left out of the list.
+    """
+    total_ms = sum(self_us for self_us, _, _, _ in imports) / 1000
+    ok = total_ms <= budget_ms
+    print(f"{entry_point}: {total_ms:,.0f} ms for {len(imports)} modules "
+          f"({'within' if ok else 'OVER'} the {budget_ms:,.0f} ms budget)")
+
+    # Modules imported directly by the entry point's statements
+    first_level = sorted((i for i in imports if i[2] == 0 and i[3] not in startup), key=lambda i: -i[1])
+    for _, cumulative_us, _, name in first_level[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    deferred = deferred_imported(imports)
+    for module in deferred:
+        print(f"  {module} is imported at start; import it where it is used")
+    return ok and not deferred
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entry_points", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MS)))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per entry point, the fastest is kept")
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    args = parser.parse_args(argv)
+
+    startup = {name for _, _, _, name in measure("pass")}
+    ok = True
+    for entry_point in args.entry_points:
+        code = import_statements(os.path.join(ROOT, entry_point))
+        runs = [measure(code) for _ in range(args.repeat)]
+        fastest = min(runs, key=lambda imports: sum(i[0] for i in imports))
+        ok &= report(entry_point, fastest, args.budget_ms, args.top, startup)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+Check that users.clean_cr_users_to_single_language returns exactly what the
+original sort / merge implementation (reference_clean_cr_users_to_single_language
+below) returns: same rows, order, index and dtypes, for both frames, given the
+object-typed columns the original was written for.  The frames as loaded
+(Arrow strings, categoricals) are also run through it and must give the same
+shared frames once apply_schema has been applied.
+
+Runs both on synthetic datasets (see synthetic_data.py), as loaded by the
+dashboard and again with edge cases mixed in: missing languages on duplicated
+rows, missing furthest_event / max_user_level, exact ties and user_pseudo_ids
+shared between users.
+
+    python check_single_language.py --users 20000 --seeds 0 1 2
+    python check_single_language.py --local local_data     # an existing dataset
+
+Exits non-zero on the first mismatch.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+from datasources import BACKEND_ENV, DATA_DIR_ENV, get_offline_filesystem
+from schema import EVENT_ORDER, apply_schema, app_launch_schema, progress_schema
+from shard_cache import CACHE_DIR_ENV
+
+
+def reference_clean_cr_users_to_single_language(df_app_launch, df_cr_users):
+    """The original implementation, kept verbatim as the specification."""
+
+    # ✅  Identify and remove all duplicates from df_app_launch, but SAVE them for later
+    duplicate_user_ids = df_app_launch[df_app_launch.duplicated(subset='user_pseudo_id', keep=False)]
+    df_app_launch = df_app_launch[~df_app_launch["cr_user_id"].isin(duplicate_user_ids["cr_user_id"])]
+
+    # ✅  Get list of users that had duplicates
+    unique_duplicate_ids = duplicate_user_ids['cr_user_id'].unique().tolist()
+
+    # ✅  Define event ranking of the funnel
+    event_order = EVENT_ORDER
+    event_rank = {event: rank for rank, event in enumerate(event_order)}
+
+    # ✅  Ensure "furthest_event" has no missing values
+
+    df_cr_users["furthest_event"] = df_cr_users["furthest_event"].fillna("unknown")
+
+    # ✅ Map event to numeric rank
+    df_cr_users["event_rank"] = df_cr_users["furthest_event"].map(event_rank)
+
+    # ✅ Flag whether event is "level_completed" - this means we switch to level number to determine furthest progress
+    df_cr_users["is_level_completed"] = df_cr_users["furthest_event"] == "level_completed"
+
+    # ✅ Ensure a single row per user across country & language
+    df_cr_users = df_cr_users.sort_values(["cr_user_id", "is_level_completed", "max_user_level", "event_rank"],
+                                          ascending=[True, False, False, False])
+
+    df_cr_users = df_cr_users.drop_duplicates(subset=["cr_user_id"], keep="first")  # ✅ Keep only best progress row
+
+    # ✅ Ensure every user in df_cr_users has a matching row in df_app_launch
+    users_to_update = df_cr_users[["cr_user_id", "app_language", "country"]].merge(
+        df_app_launch[["cr_user_id", "app_language", "country"]],
+        on="cr_user_id",
+        how="left",
+        suffixes=("_cr", "_app")
+    )
+
+    # ✅ Find users where the `app_language` in df_app_launch does not match the selected best `app_language` from df_cr_users
+    language_mismatch = users_to_update[users_to_update["app_language_cr"] != users_to_update["app_language_app"]]
+
+    if not language_mismatch.empty:
+
+        # ✅ Update df_app_launch to reflect the correct `app_language` from df_cr_users
+        df_app_launch.loc[df_app_launch["cr_user_id"].isin(language_mismatch["cr_user_id"]), "app_language"] = \
+            df_app_launch["cr_user_id"].map(df_cr_users.set_index("cr_user_id")["app_language"])
+
+    # ✅ Ensure all users with duplicates exist in df_cr_users
+    missing_users = set(unique_duplicate_ids) - set(df_cr_users["cr_user_id"])
+
+    # ✅ Add back the correct user rows in df_app_launch, ensuring **matching language & country**
+    users_to_add_back = duplicate_user_ids.merge(
+        df_cr_users[["cr_user_id", "app_language", "country"]],
+        on=["cr_user_id", "app_language", "country"],
+        how="left"
+    )
+
+    # ✅ Drop NaN values to ensure only valid rows are added back
+    users_to_add_back = users_to_add_back.dropna(subset=["app_language"])
+
+    # ✅ If any users are still missing, add a fallback row for them
+    fallback_users = duplicate_user_ids[duplicate_user_ids["cr_user_id"].isin(missing_users)]
+    fallback_users = fallback_users.drop_duplicates(subset="cr_user_id", keep="first")
+
+    # Append the fallback users
+    users_to_add_back = pd.concat([users_to_add_back, fallback_users])
+
+    # ✅ Deduplicate to ensure only one row per cr_user_id is added back
+    users_to_add_back = users_to_add_back.drop_duplicates(subset="cr_user_id", keep="first")
+
+    # ✅ Restore users into df_app_launch
+    df_app_launch = pd.concat([df_app_launch, users_to_add_back])
+
+    # ✅ Ensure df_app_launch has only unique cr_user_id
+
+    df_app_launch = df_app_launch.drop_duplicates(subset="cr_user_id", keep="first")
+
+    # This is a fix for a nasty bug where a user can have a different first_open in one dataframe vs the other.
+    # Its because cr_app_launch is Curious Reader first open but cr_user_progress is FTM first_open
+    df_cr_users["first_open"] = df_cr_users["cr_user_id"].map(df_app_launch.set_index("cr_user_id")["first_open"])
+    return df_app_launch, df_cr_users
+
+
+def with_edge_cases(app_launch, progress, seed):
+    """Copies of the frames with the rare cases the real data can contain mixed in."""
+    rng = np.random.default_rng(seed)
+    app_launch = app_launch.copy()
+    progress = progress.copy()
+
+    def some(df, share):
+        return rng.random(len(df)) < share
+
+    # user_pseudo_ids shared between different cr_user_ids
+    shared = np.flatnonzero(some(app_launch, 0.01))
+    app_launch.iloc[shared, app_launch.columns.get_loc("user_pseudo_id")] = \
+        app_launch["user_pseudo_id"].to_numpy()[rng.permutation(shared)]
+    # missing languages, including on every row of some duplicated users
+    app_launch.loc[some(app_launch, 0.01), "app_language"] = None
+    duplicated = app_launch.loc[app_launch.duplicated("user_pseudo_id", keep=False), "cr_user_id"]
+    no_language = duplicated.drop_duplicates().sample(frac=0.3, random_state=seed)
+    app_launch.loc[app_launch["cr_user_id"].isin(no_language), "app_language"] = None
+    # duplicated rows whose users then lose their progress rows (fallback path)
+    duplicated = app_launch.loc[app_launch.duplicated("user_pseudo_id", keep=False), "cr_user_id"]
+    dropped = duplicated.drop_duplicates().sample(frac=0.2, random_state=seed)
+    progress = progress[~progress["cr_user_id"].isin(dropped)]
+    # missing progress values and exact ties between a user's rows
+    progress.loc[some(progress, 0.02), "furthest_event"] = None
+    progress.loc[some(progress, 0.02), "max_user_level"] = np.nan
+    ties = progress[progress["cr_user_id"].duplicated(keep=False)].sample(frac=0.3, random_state=seed)
+    progress = pd.concat([progress, ties.assign(country="Tie")]).sample(frac=1, random_state=seed)
+    return app_launch, progress
+
+
+def plain(df):
+    """df with string and categorical columns as Python objects."""
+    return df.astype({col: object for col, dtype in df.dtypes.items()
+                      if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(dtype)})
+
+
+def compare(app_launch, progress, label):
+    from users import clean_cr_users_to_single_language
+
+    start = time.perf_counter()
+    expected = reference_clean_cr_users_to_single_language(plain(app_launch), plain(progress))
+    reference_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = clean_cr_users_to_single_language(plain(app_launch), plain(progress))
+    seconds = time.perf_counter() - start
+
+    for name, want, got in zip(["app_launch", "progress"], expected, actual):
+        pd.testing.assert_frame_equal(got, want, obj=f"{label} {name}")
+
+    loaded = clean_cr_users_to_single_language(app_launch.copy(), progress.copy())
+    for name, schema, want, got in zip(["app_launch", "progress"], [app_launch_schema, progress_schema],
+                                       expected, loaded):
+        pd.testing.assert_frame_equal(apply_schema(got, schema), apply_schema(want, schema),
+                                      obj=f"{label} {name} as loaded")
+    print(f"{label}: {len(app_launch):,} app launch / {len(progress):,} progress rows identical "
+          f"({reference_seconds:.2f}s reference, {seconds:.2f}s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20_000, help="users per generated dataset")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--local", help="check an existing local dataset instead of generating")
+    args = parser.parse_args(argv)
+
+    # Same pandas mode as the dashboard (settings.initialize)
+    pd.options.mode.copy_on_write = True
+    import users
+
+    if args.local:
+        os.environ[BACKEND_ENV] = "local"
+        os.environ[DATA_DIR_ENV] = args.local
+        datasets = [(args.local, args.seeds[0])]
+    else:
+        os.environ[BACKEND_ENV] = "memory"
+        datasets = [(f"seed {seed}", seed) for seed in args.seeds]
+
+    for label, seed in datasets:
+        if not args.local:
+            fs = get_offline_filesystem("memory")
+            if fs.exists("/"):
+                fs.rm("/", recursive=True)
+            synthetic_data.generate(fs, args.users, seed=seed)
+        # A fresh shard cache per dataset, so nothing is reused between them
+        with tempfile.TemporaryDirectory(prefix="cl-shards-") as cache_dir:
+            os.environ[CACHE_DIR_ENV] = cache_dir
+            app_launch, progress, _ = users.load_campaign_user_frames()
+        try:
+            compare(app_launch, progress, label)
+            compare(*with_edge_cases(app_launch, progress, seed), f"{label} + edge cases")
+        except AssertionError as e:
+            print(e)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import pandas as pd
+from pandas.api.types import union_categoricals
+from metrics import FUNNEL_STATS, GC_MIN_GPC, LA_MIN_LEVEL, RA_MIN_LEVEL
+from schema import event_rank
+
+# Pre-aggregated funnel counts for the whole user dataset.
+#
+# One row per distinct (first_open, country, app_language, source_id,
+# campaign_id) holding how many users in that cell reached each stat.  Every
+# filter the home page offers is a condition on those dimensions, so any
+# cohort's totals are the sum of the matching cells; the per-user frames are
+# not touched and the cost grows with the number of cells, not users.
+
+DIMENSIONS = ["first_open", "country", "app_language", "source_id", "campaign_id"]
+STATS = FUNNEL_STATS
+
+# LR counts app launch rows (Learners Reached metric); LR_users counts distinct
+# cr_user_ids, which is what the funnel's first stage shows.
+COUNT_COLUMNS = STATS + ["LR_users"]
+
+
+def _stage_flags(progress):
+    rank = progress["furthest_event"]
+    level = progress["max_user_level"]
+    gpc = progress["gpc"]
+    return {
+        "DC": rank >= event_rank("download_completed"),
+        "TS": rank >= event_rank("tapped_start"),
+        "SL": rank >= event_rank("selected_level"),
+        "PC": rank >= event_rank("puzzle_completed"),
+        "LA": (level >= LA_MIN_LEVEL).fillna(False),
+        "RA": (level >= RA_MIN_LEVEL).fillna(False),
+        "GC": ((level >= LA_MIN_LEVEL) & (gpc >= GC_MIN_GPC)).fillna(False),
+    }
+
+
+def _aggregate(df, counts):
+    cells = df[DIMENSIONS].assign(**{name: values.astype("int64") for name, values in counts.items()})
+    return cells.groupby(DIMENSIONS, observed=True, dropna=False).sum().reset_index()
+
+
+def build_cohort_cube(campaign_users_app_launch, campaign_users_progress):
+    """Build the cube from the shared (schema-typed) user frames."""
+    app_launch = _aggregate(campaign_users_app_launch, {
+        "LR": pd.Series(True, index=campaign_users_app_launch.index),
+        "LR_users": campaign_users_app_launch["cr_user_id"].notna(),
+    })
+    progress = _aggregate(campaign_users_progress, _stage_flags(campaign_users_progress))
+
+    # Give both halves the same categories so they concatenate as categoricals
+    for dim in DIMENSIONS[1:]:
+        categories = union_categoricals(
+            [app_launch[dim].astype("category"), progress[dim].astype("category")]).categories
+        app_launch[dim] = app_launch[dim].astype(pd.CategoricalDtype(categories))
+        progress[dim] = progress[dim].astype(pd.CategoricalDtype(categories))
+
+    cube = pd.concat([app_launch, progress], ignore_index=True)
+    cube[COUNT_COLUMNS] = cube[COUNT_COLUMNS].fillna(0)
+    cube = cube.groupby(DIMENSIONS, observed=True, dropna=False)[COUNT_COLUMNS].sum().reset_index()
+    cube[COUNT_COLUMNS] = cube[COUNT_COLUMNS].astype("int64")
+    return cube
+
+
+def cohort_totals(
+    cube,
+    daterange=None,
+    languages=["All"],
+    countries_list=["All"],
+    source_id=None,
+    campaign_id=None,
+):
+    """
+    Totals per stat for the cohort matching the filters, with the same filter
+    semantics as metrics.get_user_cohort_df.  Returns {stat: count}.
+    """
+    mask = pd.Series(True, index=cube.index)
+    if daterange is not None and len(daterange) == 2:
+        start = pd.to_datetime(daterange[0])
+        end = pd.to_datetime(daterange[1])
+        mask &= ((cube["first_open"] >= start) & (cube["first_open"] <= end)).fillna(False)
+    if countries_list and countries_list != ["All"]:
+        mask &= cube["country"].isin(countries_list)
+    if languages and languages != ["All"]:
+        mask &= cube["app_language"].isin(languages)
+    if source_id is not None:
+        mask &= cube["source_id"] == source_id
+    if campaign_id is not None:
+        mask &= cube["campaign_id"] == campaign_id
+
+    return cube.loc[mask.to_numpy(dtype=bool), COUNT_COLUMNS].sum().to_dict()
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Row index over one of the shared user frames, built once per data version.
+#
+#   - rows ordered by first_open, so a date range is two searchsorted calls
+#     into the sorted day numbers
+#   - per dimension (country, app_language, source_id, campaign_id) an
+#     inverted index from category code to the ascending row ids holding it
+#
+# A query starts from whichever of those candidate sets is smallest and checks
+# the remaining conditions on just those rows with per-row lookups, so its cost
+# follows the size of the result rather than the table.  The frame itself is
+# never reordered or copied; a query returns the selected row positions in
+# their original order.
+
+DATE_COLUMN = "first_open"
+DIMENSIONS = ["country", "app_language", "source_id", "campaign_id"]
+
+
+MISSING_DAY = np.iinfo(np.int32).min
+
+
+def _day_numbers(values):
+    """Days since epoch as int32, MISSING_DAY where the date is missing."""
+    days = pa.array(values.astype(pd.ArrowDtype(pa.date32()))).cast(pa.int32())
+    return days.fill_null(MISSING_DAY).to_numpy().astype(np.int32)
+
+
+class _Postings:
+    """Ascending row ids per category code of one categorical column."""
+
+    def __init__(self, column):
+        self.categories = column.cat.categories
+        self.codes = column.cat.codes.to_numpy()
+        self.rows = np.argsort(self.codes, kind="stable").astype(np.int32)
+        counts = np.bincount(self.codes + 1, minlength=len(self.categories) + 1)
+        # Code -1 (missing) sorts first; offsets[c + 1] .. offsets[c + 2] are code c's rows
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def lookup_codes(self, values):
+        codes = self.categories.get_indexer(list(values))
+        return np.unique(codes[codes >= 0])
+
+    def size(self, codes):
+        return int(sum(self.offsets[c + 2] - self.offsets[c + 1] for c in codes))
+
+    def rows_for(self, codes):
+        parts = [self.rows[self.offsets[c + 1]:self.offsets[c + 2]] for c in codes]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+
+    def member(self, rows, codes):
+        allowed = np.zeros(len(self.categories), dtype=bool)
+        allowed[codes] = True
+        row_codes = self.codes[rows]
+        return (row_codes >= 0) & allowed[row_codes]
+
+
+class CohortIndex:
+    def __init__(self, frame, date_column=DATE_COLUMN, dimensions=DIMENSIONS):
+        self.frame = frame
+        self.days = _day_numbers(frame[date_column])
+        dated = np.flatnonzero(self.days != MISSING_DAY)
+        self.date_order = dated[np.argsort(self.days[dated], kind="stable")].astype(np.int32)
+        self.sorted_days = self.days[self.date_order]
+        self.postings = {dim: _Postings(frame[dim]) for dim in dimensions if dim in frame.columns}
+
+    def __len__(self):
+        return len(self.frame)
+
+    def select(
+        self,
+        daterange=None,
+        languages=["All"],
+        countries_list=["All"],
+        source_id=None,
+        campaign_id=None,
+    ):
+        """
+        Row positions of the cohort matching the filters, in frame order, with
+        the same semantics as metrics.get_user_cohort_df.  None means every row.
+        """
+        conditions = []  # (estimated size, kind, payload)
+
+        if daterange is not None and len(daterange) == 2:
+            start = _to_day(daterange[0], round_up=True)
+            end = _to_day(daterange[1])
+            lo = np.searchsorted(self.sorted_days, start, side="left")
+            hi = np.searchsorted(self.sorted_days, end, side="right")
+            conditions.append((max(hi - lo, 0), "date", (lo, hi, start, end)))
+
+        selections = {
+            "country": countries_list if countries_list and countries_list != ["All"] else None,
+            "app_language": languages if languages and languages != ["All"] else None,
+            "source_id": [source_id] if source_id is not None else None,
+            "campaign_id": [campaign_id] if campaign_id is not None else None,
+        }
+        for dim, values in selections.items():
+            if values is None:
+                continue
+            postings = self.postings[dim]
+            codes = postings.lookup_codes(values)
+            conditions.append((postings.size(codes), dim, codes))
+
+        if not conditions:
+            return None
+
+        conditions.sort(key=lambda c: c[0])
+        size, kind, payload = conditions[0]
+        if kind == "date":
+            lo, hi, _, _ = payload
+            rows = np.sort(self.date_order[lo:hi])
+        else:
+            rows = self.postings[kind].rows_for(payload)
+
+        for _, kind, payload in conditions[1:]:
+            if len(rows) == 0:
+                break
+            if kind == "date":
+                _, _, start, end = payload
+                row_days = self.days[rows]
+                rows = rows[(row_days >= start) & (row_days <= end)]
+            else:
+                rows = rows[self.postings[kind].member(rows, payload)]
+        return rows
+
+    def cohort(self, **filters):
+        """The matching rows of the frame as a DataFrame."""
+        rows = self.select(**filters)
+        if rows is None:
+            return self.frame
+        return self.frame.take(rows)
+
+
+def _to_day(value, round_up=False):
+    timestamp = pd.Timestamp(value)
+    day = (timestamp.normalize() - pd.Timestamp(0)).days
+    if round_up and timestamp != timestamp.normalize():
+        day += 1
+    return int(day)
@@ -0,0 +1,178 @@
+import datetime as dt
+import os
+import re
+import streamlit as st
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# The dashboard reads two kinds of data:
+#   - the user parquet caches in GCS (user_data_parquet_cache/*.parquet)
+#   - campaign / lookup tables from BigQuery
+#
+# CL_DATA_BACKEND selects where they come from:
+#   "gcs"    (default) production GCS bucket and BigQuery client
+#   "local"  a directory on disk laid out like production, see CL_DATA_DIR
+#   "memory" an fsspec in-memory filesystem, handy for scripts and benchmarks
+#
+# The offline layout is:
+#   <root>/user_data_parquet_cache/<dataset>_<shard>.parquet
+#   <root>/bigquery/<table>.parquet
+# and can be generated with `python synthetic_data.py`.
+
+GCP_PROJECT = "dataexploration-193817"
+BACKEND_ENV = "CL_DATA_BACKEND"
+DATA_DIR_ENV = "CL_DATA_DIR"
+MEMORY_ROOT = "/cl-data"
+BIGQUERY_DIR = "bigquery"
+FAKE_DATE_COLUMN = "segment_date"
+
+
+def get_backend():
+    return os.environ.get(BACKEND_ENV, "gcs").lower()
+
+
+def is_offline():
+    return get_backend() != "gcs"
+
+
+def get_offline_filesystem(backend=None, root=None):
+    """Filesystem rooted at the offline data directory, so paths match the GCS layout."""
+    import fsspec
+    from fsspec.implementations.dirfs import DirFileSystem
+
+    backend = backend or get_backend()
+    if backend == "local":
+        root = root or os.environ.get(DATA_DIR_ENV, "local_data")
+        return DirFileSystem(os.path.abspath(root), fs=fsspec.filesystem("file"))
+    if backend == "memory":
+        return DirFileSystem(root or MEMORY_ROOT, fs=fsspec.filesystem("memory"))
+    raise ValueError(f"Unknown offline data backend: {backend}")
+
+
+@st.cache_resource(ttl="1d")
+def get_filesystem():
+    """Filesystem holding user_data_parquet_cache for the configured backend."""
+    if is_offline():
+        return get_offline_filesystem()
+
+    import gcsfs
+    from settings import get_gcp_credentials
+
+    credentials, _ = get_gcp_credentials()
+    return gcsfs.GCSFileSystem(project=GCP_PROJECT, token=credentials)
+
+
+@st.cache_resource(ttl="1d")
+def get_bq_client():
+    """BigQuery client for the configured backend."""
+    if is_offline():
+        return FakeBigQueryClient.from_filesystem(get_offline_filesystem())
+
+    from settings import get_gcp_credentials
+
+    _, bq_client = get_gcp_credentials()
+    return bq_client
+
+
+@st.cache_resource(ttl="1d")
+def get_bqstorage_client():
+    """BigQuery Storage read client, None offline where results are local already."""
+    if is_offline():
+        return None
+
+    from google.cloud import bigquery_storage
+    from settings import get_gcp_credentials
+
+    credentials, _ = get_gcp_credentials()
+    return bigquery_storage.BigQueryReadClient(credentials=credentials)
+
+
+class FakeQueryJob:
+    """The subset of google.cloud.bigquery.QueryJob the dashboard uses."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def result(self, timeout=None):
+        return self
+
+    def cancel(self):
+        return False
+
+    def to_arrow(self, **kwargs):
+        return self._table
+
+    def to_dataframe(self, **kwargs):
+        return self._table.to_pandas()
+
+    def __iter__(self):
+        return iter(self._table.to_pylist())
+
+
+class FakeBigQueryClient:
+    """
+    Stand-in for bigquery.Client that does not evaluate SQL.
+
+    Each registered result is keyed by a table name; a query is answered with
+    the result whose name appears in the SQL (longest name wins).  A result is
+    either a DataFrame / Arrow table returned as is, or a callable taking the
+    SQL text, for queries whose answer depends on their predicates.
+
+    Results are stored with the columns their query returns.  The one predicate
+    applied is a date lower bound: with `>= 'YYYY-MM-DD'` in the SQL, only rows
+    whose segment_date is on or after the (latest) bound are returned.
+    """
+
+    def __init__(self, results=None):
+        self.results = dict(results or {})
+        self.queries = []
+
+    @classmethod
+    def from_filesystem(cls, fs, directory=BIGQUERY_DIR):
+        results = {}
+        if fs.exists(directory):
+            for path in fs.glob(f"{directory}/*.parquet"):
+                name = os.path.splitext(os.path.basename(path))[0]
+                results[name] = _lazy_parquet(fs, path)
+        return cls(results)
+
+    def register(self, name, result):
+        self.results[name] = result
+
+    def query(self, sql, **kwargs):
+        self.queries.append(sql)
+        for name in sorted(self.results, key=len, reverse=True):
+            if re.search(rf"\b{re.escape(name)}\b", sql):
+                return FakeQueryJob(_since(_to_arrow(self.results[name], sql), sql))
+        raise KeyError(f"No fake BigQuery result registered for query: {sql.strip()[:200]}")
+
+
+def _lazy_parquet(fs, path):
+    loaded = {}
+
+    def read(sql):
+        if "table" not in loaded:
+            with fs.open(path, "rb") as f:
+                loaded["table"] = pq.read_table(f)
+        return loaded["table"]
+
+    return read
+
+
+def _since(table, sql):
+    bounds = re.findall(r">=\s*'(\d{4}-\d{2}-\d{2})'", sql)
+    if not bounds or FAKE_DATE_COLUMN not in table.column_names:
+        return table
+    dates = table.column(FAKE_DATE_COLUMN)
+    since = max(dt.date.fromisoformat(bound) for bound in bounds)
+    return table.filter(pc.greater_equal(dates, pa.scalar(since).cast(dates.type)))
+
+
+def _to_arrow(result, sql):
+    if callable(result):
+        result = result(sql)
+    if isinstance(result, pd.DataFrame):
+        return pa.Table.from_pandas(result, preserve_index=False)
+    return result
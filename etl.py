@@ -0,0 +1,210 @@
+"""
+Build a dashboard-ready user data snapshot (see snapshots.py) from the
+queries/ SQL, outside the Streamlit process.
+
+Each query is run once, concurrently through a QueryExecutor (so a failing
+query is retried on its own), and its result is split into first_open
+partitions (--partition-days wide) on the client.  The queries scan the whole
+event history whatever their first_open bounds, since the events_* tables are
+sharded by event date, so one job per query is the cheapest way to read them.
+Each partition is cleaned batch by batch as the dashboard cleans the parquet
+caches, under one memory budget; the rows are then resolved to one language
+per user, cast to schema.py types and written as a new snapshot version.
+
+    python etl.py                                  # from BigQuery
+    python etl.py --source export                  # the exported parquet caches
+    CL_DATA_BACKEND=local CL_DATA_DIR=local_data python etl.py --source export
+    python etl.py --dry-run                        # print the SQL
+
+--source export answers the same SQL from the parquet caches the
+queries were exported to (user_data_parquet_cache/<dataset>_*.parquet), which
+is also how the pipeline runs offline.  Point the dashboard at the result with
+CL_USER_DATA_SOURCE=snapshot.
+"""
+import argparse
+import datetime as dt
+import os
+import re
+import sys
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import snapshots
+import telemetry
+import users
+from datasources import FakeBigQueryClient, get_bq_client, get_filesystem
+from query_executor import DEFAULT_MAX_JOBS, MAX_JOBS_ENV, QueryExecutor
+from schema import arrow_to_pandas
+from shard_cache import BATCH_ROWS, MemoryBudget
+
+QUERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries")
+EXPORT_DIR = "user_data_parquet_cache"
+
+# Dataset name -> (SQL file, columns kept, per-batch cleanup), in the order of
+# the frames users.prepare_campaign_user_frames takes
+DATASETS = {
+    "cr_app_launch_campaign_data": (
+        "cr_app_launch_campaign_data.sql", users.app_launch_columns, users.clean_campaign_user_batch),
+    "cr_user_progress_campaign_data": (
+        "cr_users_progress_campaign_data.sql", users.progress_columns, users.clean_campaign_user_batch),
+    "unattributed_app_launch_events": (
+        "unattributed_app_launch_events.sql", users.unattributed_columns, users.rollup_unattributed_batch),
+}
+
+# First first_open the queries select
+FIRST_DATE = dt.date(2024, 11, 8)
+
+
+def read_query(filename):
+    with open(os.path.join(QUERY_DIR, filename)) as f:
+        return f.read().strip().rstrip(";")
+
+
+def partitions(start, end, days):
+    """
+    (lo, hi) first_open ranges from start to end, days wide.  The first is open
+    below (and takes missing first_open) and the last open above, so together
+    they cover every row whatever its first_open.
+    """
+    bounds = [start + dt.timedelta(days=d) for d in range(days, (end - start).days + 1, days)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def query_sql(name, sql, columns):
+    """The dataset's query, projected to the columns the dashboard keeps."""
+    return (f"-- {name}\n"
+            f"SELECT {', '.join(columns)}\n"
+            f"FROM (\n{sql}\n) AS {name}")
+
+
+def split_partitions(table, ranges):
+    """
+    table's rows as one table per (lo, hi) first_open range of ranges (as
+    partitions() returns them), each in the order the query returned its rows.
+    """
+    if "first_open" not in table.column_names:
+        return [table] + [table.slice(0, 0)] * (len(ranges) - 1)
+    # Days since epoch; a missing first_open goes in the first partition
+    days = table.column("first_open").cast(pa.date32()).cast(pa.int32()).to_numpy(zero_copy_only=False)
+    days = np.nan_to_num(days.astype(np.float64), nan=-np.inf)
+    bounds = [(hi - dt.date(1970, 1, 1)).days for _, hi in ranges[:-1]]
+    partition = np.searchsorted(bounds, days, side="right")
+
+    order = np.argsort(partition, kind="stable")
+    starts = np.searchsorted(partition[order], np.arange(len(ranges) + 1))
+    table = table.take(order)
+    return [table.slice(start, end - start) for start, end in zip(starts[:-1], starts[1:])]
+
+
+def export_client(fs, directory=EXPORT_DIR):
+    """
+    FakeBigQueryClient answering query_sql queries from the exported parquet
+    caches: the selected columns of every row.
+    """
+    client = FakeBigQueryClient()
+    for name in DATASETS:
+        paths = sorted(fs.glob(f"{directory}/{name}_*.parquet"))
+        if paths:
+            client.register(name, _export_reader(fs, paths))
+    return client
+
+
+def _export_reader(fs, paths):
+    dataset = ds.dataset(paths, format="parquet", filesystem=fs)
+
+    def read(sql):
+        columns = [c.strip() for c in re.search(r"^SELECT (.*)$", sql, re.M).group(1).split(",")]
+        return dataset.to_table(columns=[c for c in columns if c in dataset.schema.names])
+
+    return read
+
+
+def clean(tables, transform, budget, name):
+    """The partition results cleaned batch by batch into one table."""
+    cleaned = []
+    for table in tables:
+        batches = []
+        for batch in table.to_batches(max_chunksize=BATCH_ROWS):
+            batches.append(transform(batch))
+            budget.check(name)
+        if batches:
+            cleaned.append(pa.Table.from_batches(batches))
+    if not cleaned:
+        empty = pa.RecordBatch.from_pylist([], schema=tables[0].schema)
+        return pa.Table.from_batches([transform(empty)])
+    return pa.concat_tables(cleaned, promote_options="default")
+
+
+def run(client, fs, start, end, partition_days, keep=None, max_jobs=DEFAULT_MAX_JOBS, source=None):
+    """Query, clean and write one snapshot; returns (version, manifest)."""
+    budget = MemoryBudget()
+    executor = QueryExecutor(client, max_jobs=max_jobs)
+    ranges = partitions(start, end, partition_days)
+
+    # One job per query, all running at once
+    jobs = {name: executor.submit(query_sql(name, read_query(filename), columns))
+            for name, (filename, columns, _) in DATASETS.items()}
+
+    frames = []
+    for name, (_, _, transform) in DATASETS.items():
+        with telemetry.stage("etl.query", dataset=name):
+            result = jobs[name].result()
+        with telemetry.stage("etl.clean", dataset=name):
+            tables = split_partitions(result, ranges)
+            del result
+            frames.append(arrow_to_pandas(clean(tables, transform, budget, name)))
+
+    frames = users.finish_user_frames(*users.prepare_campaign_user_frames(*frames))
+    budget.check("user snapshot")
+
+    metadata = {
+        "source": source,
+        "first_open_from": start.isoformat(),
+        "first_open_to": end.isoformat(),
+        "partition_days": partition_days,
+        "partitions": len(ranges),
+        "queries": sorted(filename for filename, _, _ in DATASETS.values()),
+        "memory": budget.report(),
+    }
+    with telemetry.stage("etl.write_snapshot"):
+        version = snapshots.write_snapshot(fs, frames, metadata, keep=keep)
+    return version, snapshots.read_manifest(fs, version)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=["bigquery", "export"], default="bigquery")
+    parser.add_argument("--start", type=dt.date.fromisoformat, default=FIRST_DATE,
+                        help="first partition boundary (earlier first_opens go in the first partition)")
+    parser.add_argument("--end", type=dt.date.fromisoformat, default=dt.date.today(),
+                        help="last partition boundary (later first_opens go in the last partition)")
+    parser.add_argument("--partition-days", type=int, default=7)
+    parser.add_argument("--keep", type=int, default=7, help="snapshot versions to keep")
+    parser.add_argument("--dry-run", action="store_true", help="print the SQL and exit")
+    args = parser.parse_args(argv)
+
+    if args.dry_run:
+        for name, (filename, columns, _) in DATASETS.items():
+            print(query_sql(name, read_query(filename), columns), end=";\n\n")
+        return 0
+
+    # Same pandas mode as the dashboard (settings.initialize)
+    import pandas as pd
+    pd.options.mode.copy_on_write = True
+    telemetry.configure()
+
+    fs = get_filesystem()
+    client = export_client(fs) if args.source == "export" else get_bq_client()
+    with telemetry.stage("etl.run", source=args.source):
+        version, manifest = run(client, fs, args.start, args.end, args.partition_days, keep=args.keep,
+                                max_jobs=int(os.environ.get(MAX_JOBS_ENV, DEFAULT_MAX_JOBS)),
+                                source=args.source)
+
+    rows = ", ".join(f"{name} {frame['rows']:,}" for name, frame in manifest["frames"].items())
+    print(f"Snapshot {version}: {rows} ({manifest['partitions']} partitions, {manifest['memory']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
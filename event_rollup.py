@@ -0,0 +1,61 @@
+import pyarrow as pa
+
+# Daily app launch counts for the Unattributed Events tab.
+#
+# The tab only ever counts launches per day and per country, for a date range
+# and a country / language (and, for attributed launches, source) selection.
+# So the dataset keeps one row per distinct
+#
+#   unattributed: (event_date, country, app_language)
+#   attributed:   (event_date, country, app_language, source_id)
+#
+# with the number of launches in it, a few thousand rows whatever the number
+# of users.  The unattributed launches are rolled up batch by batch while
+# they are read (rollup_batch), so their rows are never held at all.
+
+UNATTRIBUTED_KEYS = ["event_date", "country", "app_language"]
+ATTRIBUTED_KEYS = UNATTRIBUTED_KEYS + ["source_id"]
+COUNT = "count"
+
+
+def rollup_batch(batch, keys=UNATTRIBUTED_KEYS):
+    """One row per distinct keys in an Arrow record batch, with its row count."""
+    table = pa.Table.from_batches([batch]).group_by(keys, use_threads=False).aggregate([([], "count_all")])
+    return pa.record_batch(
+        [table.column(key).combine_chunks() for key in keys] + [table.column("count_all").combine_chunks()],
+        names=keys + [COUNT],
+    )
+
+
+def rollup(df, keys):
+    """
+    One row per distinct keys (missing values included) in key order, with the
+    number of rows of df in it, or the sum of its counts if df is a rollup
+    already.
+    """
+    groups = df.groupby(keys, observed=True, dropna=False, sort=True)
+    counts = groups[COUNT].sum() if COUNT in df.columns else groups.size()
+    return counts.astype("int64").rename(COUNT).reset_index()
+
+
+def select(df, daterange, countries_list=["All"], languages=["All"], source_id=None):
+    """The rollup rows inside daterange (inclusive) matching the selections."""
+    dates = df["event_date"]
+    mask = ((dates >= daterange[0]) & (dates <= daterange[1])).fillna(False).to_numpy(dtype=bool)
+    if countries_list[0] != "All":
+        mask &= df["country"].isin(set(countries_list)).to_numpy()
+    if languages[0] != "All":
+        mask &= df["app_language"].isin(set(languages)).to_numpy()
+    if source_id is not None:
+        mask &= (df["source_id"] == source_id).to_numpy()
+    return df.loc[mask]
+
+
+def daily_counts(df):
+    """(event_date, event_count) for the selected rollup rows."""
+    return df.groupby("event_date")[COUNT].sum().reset_index(name="event_count")
+
+
+def country_counts(df):
+    """(country, count) for the selected rollup rows."""
+    return df.groupby("country", observed=True)[COUNT].sum().reset_index(name="count")
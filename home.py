@@ -1,23 +1,25 @@
-from users import ensure_user_data_initialized, get_language_list, get_country_list
+from users import (ensure_user_data_initialized, get_country_list, get_language_list, get_lookup_refresher,
+                   get_user_data_refresher)
 import streamlit as st
-from campaigns import rollup_campaign_data
 from millify import prettify
 import ui_widgets as ui
 import numpy as np
-import pandas as pd
 from ui_components import create_funnels_by_cohort, unattributed_events_line_chart, country_pie_chart
-from settings import default_daterange, init_data, initialize
+from settings import default_daterange, get_campaign_frames, get_campaign_refresher, init_data, initialize
+from campaign_dimension import get_campaign_dimension
+from cohort_cube import cohort_totals
+import telemetry
 from metrics import (
-    get_filtered_cohort,
-    filter_dataframe,
-    get_cohort_totals_by_metric
+    FunnelCounts,
+    get_event_summary,
+    get_user_cohort_df,
 )
 
 
 # --- INIT ---
 initialize()
 init_data()
-ensure_user_data_initialized()
+user_dataset = ensure_user_data_initialized()
 
 st.markdown(
     """
@@ -26,12 +28,16 @@ st.markdown(
     """
 )
 
+# --- Data still serving after a failed background refresh, see refresher.py ---
+for refresher in (get_campaign_refresher(), get_user_data_refresher(), get_lookup_refresher()):
+    if refresher.last_error is not None:
+        st.warning(f"Refreshing the {refresher.name} failed; showing the version loaded "
+                   f"{refresher.refreshed_at:%Y-%m-%d %H:%M} UTC")
+
 # --- Load data ---
-campaign_users_app_launch = st.session_state["campaign_users_app_launch"]
-df_campaigns_all = st.session_state["df_campaigns_all"]
-df_campaigns_rollup = rollup_campaign_data(df_campaigns_all)
-df_campaign_names = df_campaigns_rollup[['campaign_id', 'campaign_name']]
-df_unattributed_app_launch_events = st.session_state["df_unattributed_app_launch_events"]
+campaign_data = get_campaign_frames()
+campaign_dimension = get_campaign_dimension(
+    user_dataset.version, campaign_data.version, user_dataset, campaign_data)
 
 # --- Layout columns ---
 col1, col2, col3 = st.columns([1, 1, 1], gap="large")
@@ -39,9 +45,7 @@ col1, col2, col3 = st.columns([1, 1, 1], gap="large")
 with col1:
     st.subheader("Source Cohort")
 
-    df = campaign_users_app_launch
-    source_ids = sorted(df["source_id"].dropna().unique())
-    source_ids = [None] + source_ids  # "All sources" option
+    source_ids = [None] + campaign_dimension.source_ids  # "All sources" option
 
     selected_source = st.selectbox(
         "Select a Source",
@@ -51,65 +55,8 @@ with col1:
         index=0
     )
 
-        # --- Find campaigns for selected source (or all) ---
-    # --- Find campaigns for selected source (or all) ---
-    if selected_source is None:
-        filtered_app_launch = campaign_users_app_launch
-        filtered_progress = st.session_state["campaign_users_progress"]
-    else:
-        filtered_app_launch = campaign_users_app_launch[
-            campaign_users_app_launch["source_id"] == selected_source
-        ]
-        filtered_progress = st.session_state["campaign_users_progress"][
-            st.session_state["campaign_users_progress"]["source_id"] == selected_source
-        ]
-
-    # Combine campaign_ids seen in either dataset
-    user_campaign_ids = (
-        pd.concat([
-            filtered_app_launch[["campaign_id"]],
-            filtered_progress[["campaign_id"]],
-        ], ignore_index=True)
-        .dropna()
-        .drop_duplicates()
-    )
-
-    # Existing campaign_id/name pairs from rolled-up marketing data
-    df_campaign_names_existing = df_campaign_names[[
-        "campaign_id", "campaign_name"]].drop_duplicates()
-
-    # Identify campaign_ids missing from marketing data
-    missing_campaigns = user_campaign_ids[
-        ~user_campaign_ids["campaign_id"].isin(
-            df_campaign_names_existing["campaign_id"])
-    ].copy()
-
-    # Assign readable fallback names (you can customize this)
-    missing_campaigns["campaign_name"] = (
-        missing_campaigns["campaign_id"].astype(str) + " (Untracked)"
-    )
-
-    # Merge them to create a unified lookup for dropdowns and joins
-    df_campaign_names_combined = (
-        pd.concat([df_campaign_names_existing,
-                missing_campaigns], ignore_index=True)
-        .drop_duplicates(subset=["campaign_id"], keep="first")
-        .sort_values("campaign_name")
-    )
-
-    # Filter to campaigns relevant to this source selection
-    campaign_ids = sorted(user_campaign_ids["campaign_id"].dropna().unique())
-    campaign_options = df_campaign_names_combined[
-        df_campaign_names_combined["campaign_id"].isin(campaign_ids)
-    ]
-
-    # Build dropdown
-    campaign_display = [
-        f"{row['campaign_name']} ({row['campaign_id']})"
-        for _, row in campaign_options.iterrows()
-    ]
-    campaign_id_lookup = dict(
-        zip(campaign_display, campaign_options["campaign_id"]))
+    # --- Campaigns seen with the selected source (or all), by name ---
+    campaign_display, campaign_id_lookup = campaign_dimension.options(selected_source)
     campaign_display = ["All campaigns"] + campaign_display
 
     selected_campaign_display = st.selectbox(
@@ -147,66 +94,53 @@ with col2:
         countries_list = ["All"]
 
 if len(daterange) == 2:
-    # --- Main filtering: get both user_cohort_df and user_cohort_df_LR with all filters ---
-    user_cohort_df, user_cohort_df_LR = get_filtered_cohort(
-        daterange,
-        language,
-        countries_list,
-        source_id=selected_source,
-        campaign_id=selected_campaign_id
-    )
+    # Each section of the rerun is timed as a page.* stage, see telemetry.py
+    with telemetry.stage("page.filter", page="home"):
+        # --- Metrics and funnel come from the pre-aggregated cohort cube ---
+        totals = cohort_totals(
+            user_dataset.cohort_cube,
+            daterange=daterange,
+            languages=language,
+            countries_list=countries_list,
+            source_id=selected_source,
+            campaign_id=selected_campaign_id
+        )
+        LR = totals["LR"]
+        LA = totals["LA"]
 
-    LR = get_cohort_totals_by_metric(user_cohort_df_LR, stat="LR")
-    LA = get_cohort_totals_by_metric(user_cohort_df, stat="LA")
+        # --- Per-user LR cohort for the campaign table ---
+        user_cohort_df_LR = get_user_cohort_df(
+            session_df=user_dataset.app_launch_index,
+            daterange=daterange,
+            languages=language,
+            countries_list=countries_list,
+            source_id=selected_source,
+            campaign_id=selected_campaign_id
+        )
 
     with col3:
         st.subheader("")
         st.metric(label="Learners Reached", value=prettify(int(LR)))
         st.metric(label="Learners Acquired", value=prettify(int(LA)))
 
-    df_users_filtered = (
-        user_cohort_df_LR.groupby("campaign_id")
-        .agg({
-            'country': 'first',
-            'source_id': 'first',
-            'app_language': 'first',
-            'user_pseudo_id': 'size'
-        })
-        .rename(columns={'user_pseudo_id': 'LR'})
-        .reset_index()
-    )
-
-    # --- Filter and roll up campaign cost data for the date range ---
-    segment_dates = df_campaigns_all["segment_date"]
-    if np.issubdtype(segment_dates.dtype, np.datetime64):
-        segment_dates = segment_dates.dt.date
-    campaign_mask = (segment_dates >= daterange[0]) & (segment_dates <= daterange[1])
-    df_campaigns_filtered = df_campaigns_all.loc[campaign_mask]
-    df_campaigns_rollup = rollup_campaign_data(df_campaigns_filtered)
-
-    # --- Merge for table display ---
-    df_table = (
-        df_users_filtered
-        .merge(df_campaigns_rollup, on="campaign_id", how="left", suffixes=('', '_campaign'))
-        .merge(df_campaign_names, on='campaign_id', how='left', suffixes=('', '_lookup'))
-    )
+    with telemetry.stage("page.table_build", page="home"):
+        df_users_filtered = (
+            user_cohort_df_LR.groupby("campaign_id", observed=True)
+            .agg({
+                'country': 'first',
+                'source_id': 'first',
+                'app_language': 'first',
+                'user_pseudo_id': 'size'
+            })
+            .rename(columns={'user_pseudo_id': 'LR'})
+            .reset_index()
+        )
 
-    # Fill missing values in key columns and drop the unnecessary columns
-    for col in ['country', 'source_id', 'app_language']:
-        campaign_col = f"{col}_campaign"
-        if campaign_col in df_table:
-            df_table[col] = df_table[col].combine_first(df_table[campaign_col])
-    if "campaign_name_lookup" in df_table:
-        df_table["campaign_name"] = df_table["campaign_name"].fillna(
-            df_table["campaign_name_lookup"])
-        
-    # Fill missing campaign_name with campaign_id for non-marketing campaigns
-    if "campaign_name" in df_table and "campaign_id" in df_table:
-        df_table["campaign_name"] = df_table["campaign_name"].fillna(
-            df_table["campaign_id"])
+        # --- Campaign cost data rolled up for the date range ---
+        df_campaigns_rollup = campaign_data.cost_index.rollup(daterange)
 
-    df_table = df_table.drop(columns=[c for c in [
-                             'country_campaign', 'source_id_campaign', 'app_language_campaign', 'campaign_name_lookup'] if c in df_table])
+        # --- Campaign names, cost and missing dimensions for table display ---
+        df_table = campaign_dimension.enrich(df_users_filtered, df_campaigns_rollup)
 
     tab1, tab2, tab3 = st.tabs(
         ["Data Table", "CR Funnel", "Unattributed Events"])
@@ -219,39 +153,36 @@ if len(daterange) == 2:
                              'LR', "cost", "LRC", "country", "app_language"]
             final_columns = [c for c in final_columns if c in df_table]
             df_table = df_table[final_columns]
-            ui.paginated_dataframe(df_table, keys=[1, 2, 3, 4, 5])
+            with telemetry.stage("page.table_render", page="home"):
+                # The table is a function of the data versions and the selections
+                table_version = (user_dataset.version, campaign_data.version, daterange, language,
+                                 countries_list, selected_source, selected_campaign_id)
+                ui.paginated_dataframe(df_table, keys=[1, 2, 3, 4, 5], version=table_version)
         else:
             st.write("No data")
 
     st.divider()
     with tab2:
         st.header("Curious Reader Funnel")
-        create_funnels_by_cohort(
-            cohort_df=user_cohort_df,
-            key_prefix="123",
-            funnel_size="medium",
-            cohort_df_LR=user_cohort_df_LR,
-        )
+        with telemetry.stage("page.funnel", page="home"):
+            create_funnels_by_cohort(
+                cohort_df=None,
+                key_prefix="123",
+                funnel_size="medium",
+                funnel=FunnelCounts.from_totals(totals),
+            )
     with tab3:
-        attributed_df = campaign_users_app_launch
-        unattributed_df = df_unattributed_app_launch_events
-
-        attributed_df = filter_dataframe(
-            df=attributed_df,
-            countries_list=countries_list,
-            daterange=daterange,
-            language=language,
-            source_id=selected_source
-        )
-        unattributed_df = filter_dataframe(
-            df=unattributed_df,
-            countries_list=countries_list,
-            daterange=daterange,
-            language=language
-        )
-
-        count = len(unattributed_df)
-        st.header(f"Unattributed Learners Reached: {count}")
-        unattributed_events_line_chart(
-            unattributed_df=unattributed_df, attributed_df=attributed_df)
-        country_pie_chart(unattributed_df)
+        with telemetry.stage("page.event_summary", page="home"):
+            summary = get_event_summary(
+                user_dataset,
+                daterange,
+                countries_list,
+                language,
+                source_id=selected_source
+            )
+
+        st.header(f"Unattributed Learners Reached: {summary.unattributed_count}")
+        with telemetry.stage("page.chart_render", page="home"):
+            unattributed_events_line_chart(
+                unattributed_df=summary.unattributed_daily, attributed_df=summary.attributed_daily)
+            country_pie_chart(summary.unattributed_by_country)
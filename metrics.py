@@ -1,7 +1,10 @@
-import streamlit as st
-from rich import print
 import pandas as pd
-from settings import default_daterange
+from dataclasses import dataclass
+import numpy as np
+from versioned_cache import versioned_cache
+from cohort_index import CohortIndex
+import event_rollup
+from schema import EVENT_ORDER, UNKNOWN_EVENT, event_rank
 
 def get_user_cohort_df(
     session_df,
@@ -14,8 +17,18 @@ def get_user_cohort_df(
 ):
     """
     Returns a DataFrame (all columns) for the cohort matching filters.
+    session_df is a user frame, or its CohortIndex to select through the index.
     """
-    cohort_df = session_df.copy()
+    if isinstance(session_df, CohortIndex):
+        return session_df.cohort(
+            daterange=daterange,
+            languages=languages,
+            countries_list=countries_list,
+            source_id=source_id,
+            campaign_id=campaign_id,
+        )
+
+    cohort_df = session_df
 
     # Apply filters
     if daterange is not None and len(daterange) == 2:
@@ -43,48 +56,73 @@ def get_user_cohort_df(
     return cohort_df
 
 
-def get_filtered_cohort(daterange, language, countries_list, source_id=None, campaign_id=None):
-    """
-    Returns (user_cohort_df, user_cohort_df_LR) with all filters applied.
-    """
-    session_df_LR = select_user_dataframe(stat="LR")
-    user_cohort_df_LR = get_user_cohort_df(
-        session_df=session_df_LR,
-        daterange=daterange,
-        languages=language,
-        countries_list=countries_list,
-        source_id=source_id,
-        campaign_id=campaign_id
-    )
+# Funnel stages in display order
+FUNNEL_STATS = ["LR", "DC", "TS", "SL", "PC", "LA", "RA", "GC"]
 
-    session_df = select_user_dataframe()
-    user_cohort_df = get_user_cohort_df(
-        session_df=session_df,
-        daterange=daterange,
-        languages=language,
-        countries_list=countries_list,
-        source_id=source_id,
-        campaign_id=campaign_id
-    )
+# Learners Acquired / Readers Acquired level thresholds and the Game Completed
+# gpc threshold (GC also requires LA)
+LA_MIN_LEVEL = 1
+RA_MIN_LEVEL = 25
+GC_MIN_GPC = 90
+
+
+@dataclass(frozen=True)
+class FunnelCounts:
+    """User counts for each funnel stage of one cohort."""
+    LR: int
+    DC: int
+    TS: int
+    SL: int
+    PC: int
+    LA: int
+    RA: int
+    GC: int
 
-    return user_cohort_df, user_cohort_df_LR
+    @classmethod
+    def from_totals(cls, totals):
+        """From cohort_cube.cohort_totals, whose funnel LR is LR_users."""
+        return cls(**{stat: int(totals["LR_users" if stat == "LR" else stat]) for stat in FUNNEL_STATS})
 
+    def counts(self):
+        return [getattr(self, stat) for stat in FUNNEL_STATS]
 
 
-def select_user_dataframe(stat=None):
+def compute_funnel(cohort_df, cohort_df_LR=None, user_key="cr_user_id"):
     """
-    For this dashboard:
-      - If stat == "LR": use campaign_users_app_launch
-      - Else: use campaign_users_progress
+    Every funnel stage for an already filtered cohort in one sweep.
+
+    furthest_event ranks are histogrammed once and a reverse cumulative sum
+    turns "furthest stage" counts into "reached at least this stage" counts;
+    the level / gpc thresholds are read from the same rows.  LR counts the
+    distinct users of cohort_df_LR when given, else of cohort_df.
     """
-    if stat == "LR":
-        return st.session_state["campaign_users_app_launch"]
-    else:
-        return st.session_state["campaign_users_progress"]
+    lr_df = cohort_df_LR if cohort_df_LR is not None and user_key in cohort_df_LR.columns else cohort_df
+
+    rank = cohort_df["furthest_event"].to_numpy(dtype=np.int16)
+    # Bin 0 holds UNKNOWN_EVENT, bin i + 1 holds EVENT_ORDER[i]
+    furthest = np.bincount(rank - UNKNOWN_EVENT, minlength=len(EVENT_ORDER) + 1)
+    reached = furthest[::-1].cumsum()[::-1]
+
+    level = cohort_df["max_user_level"].to_numpy(dtype=np.float32, na_value=np.nan)
+    gpc = cohort_df["gpc"].to_numpy(dtype=np.float32, na_value=np.nan)
+    acquired = level >= LA_MIN_LEVEL
+
+    def reached_stage(event):
+        return int(reached[event_rank(event) - UNKNOWN_EVENT])
+
+    return FunnelCounts(
+        LR=int(lr_df[user_key].nunique()),
+        DC=reached_stage("download_completed"),
+        TS=reached_stage("tapped_start"),
+        SL=reached_stage("selected_level"),
+        PC=reached_stage("puzzle_completed"),
+        LA=int(acquired.sum()),
+        RA=int((level >= RA_MIN_LEVEL).sum()),
+        GC=int((acquired & (gpc >= GC_MIN_GPC)).sum()),
+    )
 
 
-    
-@st.cache_data(ttl="1d", show_spinner=False)
+@versioned_cache(enabled=False)  # compute_funnel is cheaper than any cache key
 def get_cohort_totals_by_metric(
     cohort_df,
     stat="LR"
@@ -93,90 +131,48 @@ def get_cohort_totals_by_metric(
     Given a cohort_df (already filtered!), count users in each funnel stage or apply stat-specific filter.
     - cohort_df: DataFrame, filtered to your user cohort (one row per user)
     - stat: string, which funnel metric to count ("LR", "DC", "TS", "SL", "PC", "LA", "RA", "GC")
+    To get several stats for the same cohort, use compute_funnel instead.
     """
-
-    # Stat-specific filters (formerly in filter_user_data)
-    if stat == "LA":
-        # Learners Acquired: max_user_level >= 1
-        return (cohort_df['max_user_level'] >= 1).sum()
-    elif stat == "RA":
-        # Readers Acquired: max_user_level >= 25
-        return (cohort_df['max_user_level'] >= 25).sum()
-    elif stat == "GC":
-        # Game Completed: max_user_level >= 1 AND gpc >= 90
-        return ((cohort_df['max_user_level'] >= 1) & (cohort_df['gpc'] >= 90)).sum()
-    elif stat == "LR":
+    if stat == "LR":
         # Learner Reached: all users in cohort
         return len(cohort_df)
+    if stat not in FUNNEL_STATS:
+        return 0  # default fallback
+    return getattr(compute_funnel(cohort_df), stat)
 
-    # Otherwise: classic funnel by furthest_event
-    furthest = cohort_df["furthest_event"]
-
-    download_completed_count = (furthest == "download_completed").sum()
-    tapped_start_count = (furthest == "tapped_start").sum()
-    selected_level_count = (furthest == "selected_level").sum()
-    puzzle_completed_count = (furthest == "puzzle_completed").sum()
-    level_completed_count = (furthest == "level_completed").sum()
-
-    if stat == "DC":
-        return (
-            download_completed_count
-            + tapped_start_count
-            + selected_level_count
-            + puzzle_completed_count
-            + level_completed_count
-        )
-    if stat == "TS":
-        return (
-            tapped_start_count
-            + selected_level_count
-            + puzzle_completed_count
-            + level_completed_count
-        )
-    if stat == "SL":
-        return (
-            selected_level_count
-            + puzzle_completed_count
-            + level_completed_count
-        )
-    if stat == "PC":
-        return (
-            puzzle_completed_count
-            + level_completed_count
-        )
-
-    return 0  # default fallback
-
-# Takes a dataframe and filters according to input parameters
-
-
-def filter_dataframe(
-    df,
-    daterange=default_daterange,
-    countries_list=["All"],
-    language=["All"],
-    source_id=None
-):
-
-    df["event_date"] = pd.to_datetime(
-        df["event_date"], format="%Y%m%d").dt.date
-
-    # Initialize a boolean mask
-    mask = (df['event_date'] >= daterange[0]) & (
-        df['event_date'] <= daterange[1])
-
-    # Apply country filter if not "All"
-    if countries_list[0] != "All":
-        mask &= df['country'].isin(set(countries_list))
-
-    # Apply language filter if not "All"
-    if language[0] != "All":
-        mask &= df['app_language'].isin(set(language))
+@dataclass(frozen=True)
+class EventSummary:
+    """Everything the Unattributed Events tab draws, for one filter selection."""
+    unattributed_count: int
+    unattributed_daily: pd.DataFrame  # event_date, event_count
+    attributed_daily: pd.DataFrame  # event_date, event_count
+    unattributed_by_country: pd.DataFrame  # country, count
 
-    if 'source_id' in df.columns and source_id is not None:
-        mask &= (df["source_id"] == source_id)
 
-    # Filter the dataframe with the combined mask
-    df = df.loc[mask]
+@versioned_cache(maxsize=64)
+def get_event_summary(dataset, daterange, countries_list, language, source_id=None):
+    """
+    Select the attributed and unattributed daily launch counts of a UserDataset
+    (see event_rollup.py) and reduce them to the small frames the tab draws.
+    Cached per data version and filter selection; treat the result as read-only.
+    """
+    attributed = event_rollup.select(
+        dataset.attributed_rollup,
+        daterange=daterange,
+        countries_list=countries_list,
+        languages=language,
+        source_id=source_id
+    )
+    unattributed = event_rollup.select(
+        dataset.unattributed_rollup,
+        daterange=daterange,
+        countries_list=countries_list,
+        languages=language
+    )
 
-    return df
+    return EventSummary(
+        unattributed_count=int(unattributed[event_rollup.COUNT].sum()),
+        unattributed_daily=event_rollup.daily_counts(unattributed),
+        attributed_daily=event_rollup.daily_counts(attributed),
+        unattributed_by_country=event_rollup.country_counts(unattributed),
+    )
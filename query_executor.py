@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+import telemetry
+from datasources import get_bq_client, get_bqstorage_client
+
+# Every BigQuery read goes through one QueryExecutor per process:
+#
+#   - results come back as Arrow (or a DataFrame built from it) over the
+#     BigQuery Storage read API, using one shared read client
+#   - a query identical to one already running joins that job instead of
+#     starting another (single flight), so sessions that miss their caches at
+#     the same time share one job
+#   - at most CL_BQ_MAX_JOBS jobs run at once, the rest wait their turn
+#   - a job that has not finished after CL_BQ_TIMEOUT seconds is cancelled
+#   - transient errors (rate limits, 5xx, dropped connections) are retried
+#     with exponential backoff
+#   - each query is a bigquery.query span (in the submitter's trace) with a
+#     bigquery.job span per attempt and a bigquery.fetch span for the result
+#     download, see telemetry.py
+#
+# Results are not kept once a query finishes; callers cache them with
+# st.cache_* as before.  Any client with the bigquery.Client query interface
+# works, including datasources.FakeBigQueryClient.
+
+MAX_JOBS_ENV = "CL_BQ_MAX_JOBS"
+TIMEOUT_ENV = "CL_BQ_TIMEOUT"
+DEFAULT_MAX_JOBS = 4
+DEFAULT_TIMEOUT = 300  # seconds
+
+ARROW = "arrow"
+DATAFRAME = "dataframe"
+
+
+def is_transient(error):
+    """Errors worth retrying the whole query for."""
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return isinstance(error, ConnectionError)
+    return isinstance(error, (
+        ConnectionError,
+        exceptions.TooManyRequests,
+        exceptions.InternalServerError,
+        exceptions.BadGateway,
+        exceptions.ServiceUnavailable,
+        exceptions.GatewayTimeout,
+    ))
+
+
+class QueryExecutor:
+    def __init__(self, client, bqstorage_client=None, max_jobs=DEFAULT_MAX_JOBS,
+                 timeout=DEFAULT_TIMEOUT, retries=2, backoff=1.0):
+        self.client = client
+        self.bqstorage_client = bqstorage_client
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.jobs_started = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="bq-query")
+        self._lock = threading.RLock()
+        self._in_flight = {}  # (sql, result kind) -> Future
+
+    def submit(self, sql, kind=ARROW):
+        """
+        Future for the result of sql, an Arrow table or a DataFrame for kind
+        DATAFRAME.  Shared with an identical query already in flight.
+        """
+        key = (sql, kind)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._pool.submit(telemetry.bind(self._run), sql, kind)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda done: self._forget(key, done))
+            return future
+
+    def query_arrow(self, sql):
+        return self.submit(sql, ARROW).result()
+
+    def query_dataframe(self, sql):
+        return self.submit(sql, DATAFRAME).result()
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def _run(self, sql, kind):
+        with telemetry.stage("bigquery.query", statement=sql.strip()[:200], kind=kind):
+            for attempt in range(self.retries + 1):
+                try:
+                    return self._run_once(sql, kind, attempt)
+                except Exception as e:
+                    if attempt == self.retries or not is_transient(e):
+                        raise
+                    time.sleep(self.backoff * 2 ** attempt)
+
+    def _run_once(self, sql, kind, attempt=0):
+        with self._lock:
+            self.jobs_started += 1
+        with telemetry.stage("bigquery.job", attempt=attempt):
+            job = self.client.query(sql, timeout=self.timeout)
+            try:
+                job.result(timeout=self.timeout)
+            except TimeoutError:
+                job.cancel()
+                raise TimeoutError(
+                    f"BigQuery job did not finish within {self.timeout}s: {sql.strip()[:200]}") from None
+        with telemetry.stage("bigquery.fetch"):
+            if kind == DATAFRAME:
+                return job.to_dataframe(bqstorage_client=self.bqstorage_client)
+            return job.to_arrow(bqstorage_client=self.bqstorage_client)
+
+
+@st.cache_resource
+def get_query_executor():
+    """
+    Process-wide QueryExecutor for the configured backend.  No ttl: an expired
+    entry is dropped without shutting its thread pool down, so every expiry
+    would leave another idle pool behind.  The clients refresh their own
+    credentials.
+    """
+    return QueryExecutor(
+        get_bq_client(),
+        get_bqstorage_client(),
+        max_jobs=int(os.environ.get(MAX_JOBS_ENV, DEFAULT_MAX_JOBS)),
+        timeout=float(os.environ.get(TIMEOUT_ENV, DEFAULT_TIMEOUT)),
+    )
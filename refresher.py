@@ -0,0 +1,110 @@
+import datetime as dt
+import os
+import threading
+import telemetry
+
+# Stale-while-revalidate for the process-wide datasets (users.get_user_dataset,
+# settings.get_campaign_frames, users.get_language_list / get_country_list).
+# Instead of a ttl after which the next page load rebuilds the data behind a
+# spinner, each dataset has a Refresher:
+#
+#   - the first version is built when the Refresher starts, once per process
+#   - a daemon thread then builds the next version every CL_REFRESH_INTERVAL
+#     seconds (default a day) while the current one keeps serving
+#   - a version is swapped in only once it is completely built, by replacing
+#     one reference, so a rerun sees either the old dataset or the new one
+#   - a failed build is logged and the current version keeps serving; the
+#     build is retried after CL_REFRESH_RETRY seconds (default 15 minutes)
+#
+# There is one Refresher per dataset per process (get_refresher), whatever
+# happens to the st.cache_resource entries of the functions returning it: a
+# cache clear must not start a second refresh thread next to the first.
+#
+# Both versions are in memory while the next one is built.  The old one is
+# freed once no rerun holds it any more; caches keyed on its version simply
+# stop matching (see versioned_cache.py).
+
+INTERVAL_ENV = "CL_REFRESH_INTERVAL"
+RETRY_ENV = "CL_REFRESH_RETRY"
+DEFAULT_INTERVAL = 24 * 60 * 60  # seconds
+DEFAULT_RETRY = 15 * 60  # seconds
+
+
+class Refresher:
+    """
+    Keeps the latest version built by build(current) serving.  build gets the
+    version currently serving (None the first time) and may return it as is
+    when nothing changed.
+    """
+
+    def __init__(self, name, build, interval=None, retry=None):
+        self.name = name
+        self.build = build
+        self.interval = float(interval if interval is not None else os.environ.get(INTERVAL_ENV, DEFAULT_INTERVAL))
+        self.retry = float(retry if retry is not None else os.environ.get(RETRY_ENV, DEFAULT_RETRY))
+        self.refreshed_at = None  # when the serving version was built
+        self.last_error = None  # (when, exception) of the last failed build since then
+        self._current = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Build the first version (errors propagate) and start refreshing it."""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._swap(self._build())
+            self._thread = threading.Thread(target=self._run, name=f"refresh-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def get(self):
+        """The version serving now."""
+        return self._current
+
+    def refresh(self):
+        """Build the next version now; True if it was swapped in, False if the build failed."""
+        try:
+            value = self._build()
+        except Exception as e:
+            self.last_error = (dt.datetime.now(dt.timezone.utc), e)
+            import settings
+            settings.get_logger().exception(
+                f"Refreshing {self.name} failed; still serving the version from {self.refreshed_at:%Y-%m-%d %H:%M} UTC")
+            return False
+        self._swap(value)
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _build(self):
+        with telemetry.stage("refresh", dataset=self.name):
+            return self.build(self._current)
+
+    def _swap(self, value):
+        self._current = value
+        self.refreshed_at = dt.datetime.now(dt.timezone.utc)
+        self.last_error = None
+
+    def _run(self):
+        wait = self.interval
+        while not self._stop.wait(wait):
+            wait = self.interval if self.refresh() else self.retry
+
+
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+def get_refresher(name, build):
+    """The process-wide Refresher for name, started (its first version built)."""
+    with _refreshers_lock:
+        refresher = _refreshers.get(name)
+        if refresher is None:
+            refresher = Refresher(name, build)
+            _refreshers[name] = refresher
+    # Outside the registry lock: the first build can take minutes.  A failed
+    # first build leaves the Refresher unstarted, and the next call retries it.
+    return refresher.start()
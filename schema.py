@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Column types for the shared user frames.  Applied once when the dataset is
+# built so every later filter works on compact types:
+#   - ids as Arrow strings instead of Python objects
+#   - low-cardinality dimensions as dictionary-encoded categoricals
+#   - furthest_event as an int8 rank into EVENT_ORDER
+#   - dates as Arrow date32 (a day number per row)
+#   - levels as small ints
+
+# Funnel order of the furthest_event values; furthest_event is stored as the
+# index into this list, UNKNOWN_EVENT when the user has none of them.
+EVENT_ORDER = ["download_completed", "tapped_start", "selected_level", "puzzle_completed", "level_completed"]
+UNKNOWN_EVENT = -1
+
+ID = "id"
+CATEGORY = "category"
+DATE = "date"
+EVENT_RANK = "event_rank"
+
+date32 = pd.ArrowDtype(pa.date32())
+
+app_launch_schema = {
+    "user_pseudo_id": ID,
+    "cr_user_id": ID,
+    "event_date": DATE,
+    "country": CATEGORY,
+    "campaign_id": CATEGORY,
+    "source_id": CATEGORY,
+    "app_language": CATEGORY,
+    "first_open": DATE,
+}
+
+progress_schema = {
+    "cr_user_id": ID,
+    "first_open": DATE,
+    "country": CATEGORY,
+    "app_language": CATEGORY,
+    "campaign_id": CATEGORY,
+    "source_id": CATEGORY,
+    "max_user_level": "int16",
+    "furthest_event": EVENT_RANK,
+    "gpc": "float32",
+}
+
+# Unattributed app launches, counted per day, country and language
+unattributed_schema = {
+    "event_date": DATE,
+    "country": CATEGORY,
+    "app_language": CATEGORY,
+    "count": "int64",
+}
+
+# Columns that may be missing from older caches
+optional_columns = {"user_pseudo_id"}
+
+
+# Arrow types kept as Arrow-backed pandas dtypes when a table is converted;
+# dictionary columns become categoricals
+pandas_types = {
+    pa.string(): pd.StringDtype("pyarrow"),
+    pa.large_string(): pd.StringDtype("pyarrow"),
+    pa.date32(): date32,
+}
+
+
+def arrow_to_pandas(table):
+    return table.to_pandas(types_mapper=pandas_types.get)
+
+
+def event_rank(event):
+    """Stored furthest_event code for an event name."""
+    return EVENT_ORDER.index(event)
+
+
+def to_event_rank(values):
+    codes = pd.Categorical(values, categories=EVENT_ORDER).codes
+    return pd.Series(codes.astype(np.int8), index=values.index)
+
+
+def to_date(values):
+    if values.dtype == date32:
+        return values
+    if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+        # event_date comes through as YYYYMMDD strings, first_open as dates
+        sample = values.dropna()
+        if len(sample) and isinstance(sample.iloc[0], str) and len(sample.iloc[0]) == 8:
+            values = pd.to_datetime(values, format="%Y%m%d", errors="coerce")
+        else:
+            values = pd.to_datetime(values, errors="coerce")
+    return values.astype(date32)
+
+
+def to_small_int(values, dtype):
+    if values.isna().any():
+        return values.astype(dtype.capitalize())
+    return values.astype(dtype)
+
+
+def apply_schema(df, schema, name="frame"):
+    """
+    Cast df to schema, dropping any column the schema does not declare.
+    Raises ValueError naming the missing columns if df does not have them all.
+    """
+    missing = [col for col in schema if col not in df.columns and col not in optional_columns]
+    if missing:
+        raise ValueError(f"{name} is missing columns: {missing}")
+
+    columns = {}
+    for col, kind in schema.items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if kind == ID:
+            values = values.astype("string[pyarrow]")
+        elif kind == CATEGORY:
+            values = values.astype("category")
+            # Sorted categories, only those present, whatever the input dtype
+            values = values.cat.remove_unused_categories()
+            values = values.cat.reorder_categories(values.cat.categories.sort_values())
+        elif kind == DATE:
+            values = to_date(values)
+        elif kind == EVENT_RANK:
+            values = to_event_rank(values)
+        elif kind.startswith("int"):
+            values = to_small_int(values, kind)
+        else:
+            values = values.astype(kind)
+        columns[col] = values
+    return pd.DataFrame(columns, index=df.index).reset_index(drop=True)
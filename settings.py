@@ -1,14 +1,10 @@
 
 import streamlit as st
-from google.oauth2 import service_account
-from google.cloud import bigquery
-from rich import print
 import pandas as pd
 import datetime as dt
-from google.cloud import secretmanager
 import json
-import asyncio
 import logging
+import telemetry
 
 default_daterange = [dt.datetime(2024, 9, 11).date(), dt.date.today()]
 
@@ -32,6 +28,11 @@ def get_logger(name="dashboard_logger"):
 
 @st.cache_resource(ttl="1d")
 def get_gcp_credentials():
+    # The Google clients take most of a second to import; only the gcs
+    # backend needs them (see check_import_time.py)
+    from google.cloud import bigquery, secretmanager
+    from google.oauth2 import service_account
+
     client = secretmanager.SecretManagerServiceClient()
     name = "projects/405806232197/secrets/service_account_json/versions/latest"
     response = client.access_secret_version(name=name)
@@ -56,37 +57,62 @@ def get_gcp_credentials():
 
 def initialize():
     pd.options.mode.copy_on_write = True
+    # Exporter for the pipeline and page timings (CL_TELEMETRY_EXPORTER), once per process
+    telemetry.configure()
     pd.set_option("display.max_columns", 20)
 
 
+@st.cache_resource(show_spinner="Loading Data")
+def get_campaign_refresher():
+    """
+    Process-wide Refresher for the CampaignData: the first load happens here,
+    later ones in the background (see refresher.py).
+    """
+    from refresher import get_refresher
+    return get_refresher("campaign data", lambda current: build_campaign_frames())
+
+
+def get_campaign_frames():
+    """CampaignData shared read-only by all sessions, the latest version fully built."""
+    return get_campaign_refresher().get()
+
+
 # Get the campaign data from BigQuery, roll it up per campaign
-def init_data():
-    from campaigns import add_country_and_language,rollup_campaign_data
+def build_campaign_frames():
+    from campaigns import CampaignData, add_country_and_language, rollup_campaign_data
+    from campaign_costs import CampaignCostIndex
+    from snapshots import new_version
     
-    # Call the combined asynchronous campaign data function
-    df_google_ads_data, df_facebook_ads_data = cache_marketing_data()
+    with telemetry.stage("campaigns.build"):
+        # Call the combined asynchronous campaign data function
+        df_google_ads_data, df_facebook_ads_data = cache_marketing_data()
+
+        #Get all campaign data by segment_date
+        df_campaigns_all = pd.concat([df_google_ads_data, df_facebook_ads_data])
+        with telemetry.stage("campaigns.country_language"):
+            df_campaigns_all = add_country_and_language(df_campaigns_all)
+        df_campaigns_all = df_campaigns_all.reset_index(drop=True)
+        with telemetry.stage("campaigns.rollup"):
+            df_campaigns_rollup = rollup_campaign_data(df_campaigns_all)
+        with telemetry.stage("campaigns.cost_index"):
+            # Spend for any date range without refiltering df_campaigns_all
+            cost_index = CampaignCostIndex(df_campaigns_all)
+
+    return CampaignData(
+        version=new_version(),
+        df_campaigns_all=df_campaigns_all,
+        df_campaigns_rollup=df_campaigns_rollup,
+        cost_index=cost_index,
+    )
 
-    #Get all campaign data by segment_date
-    df_campaigns_all = pd.concat([df_google_ads_data, df_facebook_ads_data])
-    df_campaigns_all = add_country_and_language(df_campaigns_all)
-    df_campaigns_all = df_campaigns_all.reset_index(drop=True)
-    df_campaigns_rollup = rollup_campaign_data(df_campaigns_all)
 
-    if "df_campaigns_rollup" not in st.session_state:
-        st.session_state["df_campaigns_rollup"] = df_campaigns_rollup
+def init_data():
+    get_campaign_frames()
 
-    if "df_campaigns_all" not in st.session_state:
-        st.session_state["df_campaigns_all"] = df_campaigns_all
-        
     from users import ensure_user_data_initialized
     ensure_user_data_initialized()
 
 
-@st.cache_data(ttl="1d", show_spinner="Loading Data")
 def cache_marketing_data():
     from campaigns import get_campaign_data
-    # Execute the async function and return its result synchronously
-    return asyncio.run(get_campaign_data())
-
-
-
+    return get_campaign_data()
@@ -0,0 +1,231 @@
+import fnmatch
+import json
+import os
+import sys
+import threading
+import pyarrow as pa
+import pyarrow.dataset as ds
+import telemetry
+
+# The user parquet caches are written as many small shards that never change
+# once written, and a new shard appears every day.  Rather than downloading the
+# whole history on every refresh, ShardCache keeps a local copy of each shard
+# plus a manifest of what the remote listing looked like when it was fetched:
+#
+#   <cache_dir>/manifest.json            {remote_path: {fingerprint..., "local": file}}
+#   <cache_dir>/<remote path with / -> __>
+#
+# A refresh lists the prefix, downloads only shards that are new or whose
+# generation / etag / size changed, and drops shards that disappeared.  Decoded
+# Arrow tables are also kept per shard in memory so a refresh only decodes the
+# new shards and concatenates them onto what is already loaded.
+#
+# Reads can be narrowed with a column list and an Arrow dataset filter
+# expression.  Both are applied while decoding each shard, so row groups whose
+# statistics rule them out are skipped and unused columns are never decoded.
+#
+# Shards are decoded one record batch at a time.  A read can pass a transform
+# that is applied to every batch as it arrives (users.clean_campaign_user_batch),
+# in which case only the transformed batches are kept, never a raw shard.  A
+# MemoryBudget checked after every batch puts a ceiling on the Arrow memory a
+# load adds and records the peak.
+
+CACHE_DIR_ENV = "CL_SHARD_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join(".cache", "shards")
+
+# Keys from fs.info() that change when an object is rewritten.  gcsfs reports
+# generation / etag / md5Hash, local and in-memory filesystems only size / mtime.
+FINGERPRINT_KEYS = ["generation", "etag", "md5Hash", "size", "mtime", "updated", "created"]
+
+BATCH_ROWS = 64_000
+MEMORY_LIMIT_ENV = "CL_INGEST_MEMORY_LIMIT_MB"
+
+
+def fingerprint(info):
+    return {key: str(info[key]) for key in FINGERPRINT_KEYS if info.get(key) is not None}
+
+
+class ShardCache:
+    def __init__(self, fs, cache_dir):
+        self.fs = fs
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self._decoded = {}  # remote path -> (fingerprint, {(columns, filter): pa.Table})
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_manifest(self):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def _local_path(self, remote_path):
+        return os.path.join(self.cache_dir, remote_path.strip("/").replace("/", "__"))
+
+    def sync(self, file_pattern):
+        """
+        Bring the local copies of the shards matching file_pattern up to date.
+        Returns {remote_path: local_path} for every matching shard.
+        """
+        with self._lock:
+            with telemetry.stage("shards.list", pattern=file_pattern) as span:
+                listing = self.fs.glob(file_pattern, detail=True)
+                listing = {path: info for path, info in listing.items() if info.get("type", "file") == "file"}
+                span.set_attribute("shards", len(listing))
+            if not listing:
+                raise FileNotFoundError(f"No files matching pattern: {file_pattern}")
+
+            with telemetry.stage("shards.download", pattern=file_pattern) as span:
+                downloaded = 0
+                for path, info in sorted(listing.items()):
+                    entry = self.manifest.get(path)
+                    local = self._local_path(path)
+                    if entry and entry["fingerprint"] == fingerprint(info) and os.path.exists(local):
+                        continue
+                    tmp = local + ".part"
+                    self.fs.get_file(path, tmp)
+                    os.replace(tmp, local)
+                    self.manifest[path] = {"fingerprint": fingerprint(info), "local": os.path.basename(local)}
+                    self._decoded.pop(path, None)
+                    downloaded += 1
+                span.set_attribute("shards", downloaded)
+            changed = downloaded > 0
+
+            # Shards that were deleted upstream
+            for path in [p for p in self.manifest if _matches(self.fs, p, file_pattern) and p not in listing]:
+                entry = self.manifest.pop(path)
+                self._decoded.pop(path, None)
+                try:
+                    os.remove(os.path.join(self.cache_dir, entry["local"]))
+                except FileNotFoundError:
+                    pass
+                changed = True
+
+            if changed:
+                self._write_manifest()
+            return {path: self._local_path(path) for path in sorted(listing)}
+
+    def load(self, file_pattern, columns=None, filter=None, transform=None, budget=None):
+        """
+        Sync file_pattern and return every matching shard as one Arrow table,
+        keeping only `columns` (those a shard does not have are skipped) and the
+        rows matching the `filter` expression, each batch passed through
+        `transform` if given.
+        """
+        shards = self.sync(file_pattern)
+        view = (tuple(columns) if columns is not None else None, str(filter),
+                getattr(transform, "__qualname__", None))
+        tables = []
+        with self._lock, telemetry.stage("shards.decode", pattern=file_pattern) as span:
+            decoded = 0
+            for path, local in shards.items():
+                fp = self.manifest[path]["fingerprint"]
+                cached = self._decoded.get(path)
+                if cached is None or cached[0] != fp:
+                    cached = (fp, {})
+                    self._decoded[path] = cached
+                if view not in cached[1]:
+                    cached[1][view] = read_shard(local, columns, filter, transform, budget)
+                    decoded += 1
+                tables.append(cached[1][view])
+            span.set_attribute("shards", decoded)
+        return pa.concat_tables(tables, promote_options="default")
+
+
+def read_shard(path, columns=None, filter=None, transform=None, budget=None):
+    dataset = ds.dataset(path, format="parquet")
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names]
+    if filter is not None and not _filter_applies(dataset, filter):
+        # The filter does not apply to this shard's types (e.g. a date column
+        # stored as a string); the transform still filters the decoded rows.
+        filter = None
+    return _read_batches(dataset, columns, filter, transform, budget, path)
+
+
+def _filter_applies(dataset, filter):
+    """True if filter binds to the dataset's schema (checked without reading any rows)."""
+    try:
+        dataset.scanner(columns=[], filter=filter)
+    except pa.ArrowException:
+        return False
+    return True
+
+
+def _read_batches(dataset, columns, filter, transform, budget, name):
+    batches = []
+    for batch in dataset.to_batches(columns=columns, filter=filter, batch_size=BATCH_ROWS):
+        batches.append(transform(batch) if transform is not None else batch)
+        if budget is not None:
+            budget.check(name)
+    if not batches:
+        # No matching rows; keep the (transformed) column types
+        schema = dataset.schema if columns is None else pa.schema([dataset.schema.field(c) for c in columns])
+        empty = pa.RecordBatch.from_pylist([], schema=schema)
+        batches = [transform(empty) if transform is not None else empty]
+    return pa.Table.from_batches(batches)
+
+
+class MemoryBudget:
+    """
+    Ceiling on the Arrow memory a load adds while shards are read, checked
+    after every record batch, plus the peak seen for reporting.  Memory is
+    counted from what was allocated when the budget was created, so data
+    already loaded (the version still serving, decoded shards kept from an
+    earlier load) does not count against a new load.  The limit comes from
+    CL_INGEST_MEMORY_LIMIT_MB when not given; no limit if neither is set.
+    """
+
+    def __init__(self, limit_mb=None):
+        if limit_mb is None and os.environ.get(MEMORY_LIMIT_ENV):
+            limit_mb = float(os.environ[MEMORY_LIMIT_ENV])
+        self.limit_bytes = int(limit_mb * 2**20) if limit_mb else None
+        self.baseline_bytes = pa.total_allocated_bytes()
+        self.peak_bytes = 0  # over the baseline
+
+    def check(self, what):
+        used = pa.total_allocated_bytes() - self.baseline_bytes
+        self.peak_bytes = max(self.peak_bytes, used)
+        if self.limit_bytes is not None and used > self.limit_bytes:
+            raise MemoryError(
+                f"Reading {what} needs {used / 2**20:.1f} MB more Arrow memory, "
+                f"over the {self.limit_bytes / 2**20:.1f} MB limit ({MEMORY_LIMIT_ENV})")
+
+    def report(self):
+        import resource
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss = rss if sys.platform == "darwin" else rss * 1024
+        return (f"peak Arrow memory {self.peak_bytes / 2**20:.0f} MB over "
+                f"{self.baseline_bytes / 2**20:.0f} MB already allocated, peak RSS {rss / 2**20:.0f} MB")
+
+
+def _matches(fs, path, file_pattern):
+    return fnmatch.fnmatch(path.strip("/"), fs._strip_protocol(file_pattern).strip("/"))
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_shard_cache(fs, namespace):
+    """Process-wide ShardCache for one data backend."""
+    cache_dir = os.path.join(os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR), namespace)
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = ShardCache(fs, cache_dir)
+            _caches[cache_dir] = cache
+        # The filesystem is recreated when its credentials expire; keep the
+        # decoded shards and just talk to the new one.
+        cache.fs = fs
+        return cache
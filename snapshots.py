@@ -0,0 +1,117 @@
+import datetime as dt
+import json
+import os
+import posixpath
+import pyarrow as pa
+import pyarrow.parquet as pq
+from schema import arrow_to_pandas
+
+# Dashboard-ready user data written by etl.py, on the same filesystem as the
+# parquet caches (datasources.get_filesystem):
+#
+#   user_data_parquet_cache/snapshots/<version>/<frame>.parquet
+#   user_data_parquet_cache/snapshots/<version>/manifest.json
+#   user_data_parquet_cache/snapshots/LATEST
+#
+# The frames are the shared UserDataset frames, already cleaned, resolved to
+# one language per user and cast to schema.py types, so loading one is a
+# parquet read.  LATEST names the newest complete snapshot and is written
+# last, so a reader never sees a half-written version.
+#
+# With CL_USER_DATA_SOURCE=snapshot the dashboard loads the LATEST snapshot
+# instead of cleaning the raw shards itself.
+
+SOURCE_ENV = "CL_USER_DATA_SOURCE"
+SNAPSHOT_DIR = "user_data_parquet_cache/snapshots"
+LATEST = "LATEST"
+MANIFEST = "manifest.json"
+
+FRAMES = ["campaign_users_app_launch", "campaign_users_progress", "unattributed_rollup"]
+
+
+def enabled():
+    return os.environ.get(SOURCE_ENV, "shards").lower() == "snapshot"
+
+
+def new_version():
+    return dt.datetime.now(dt.timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+
+
+def _path(*parts):
+    return posixpath.join(SNAPSHOT_DIR, *parts)
+
+
+def write_snapshot(fs, frames, metadata=None, version=None, keep=None):
+    """
+    Write frames (in FRAMES order) as a new snapshot, point LATEST at it and
+    return its version.  With keep, only the newest keep versions are left.
+    """
+    version = version or new_version()
+    fs.makedirs(_path(version), exist_ok=True)
+
+    manifest = {"version": version, "created": dt.datetime.now(dt.timezone.utc).isoformat(),
+                "frames": {}, **(metadata or {})}
+    for name, df in zip(FRAMES, frames):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with fs.open(_path(version, f"{name}.parquet"), "wb") as f:
+            pq.write_table(table, f)
+        manifest["frames"][name] = {"rows": len(df), "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()}}
+
+    with fs.open(_path(version, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    with fs.open(_path(LATEST), "w") as f:
+        f.write(version)
+
+    if keep:
+        prune(fs, keep)
+    return version
+
+
+def latest_version(fs):
+    """Version LATEST points at, None if no snapshot has been written."""
+    if not fs.exists(_path(LATEST)):
+        return None
+    with fs.open(_path(LATEST), "r") as f:
+        return f.read().strip() or None
+
+
+def list_versions(fs):
+    """Complete snapshot versions, oldest first."""
+    if not fs.exists(SNAPSHOT_DIR):
+        return []
+    versions = []
+    for path in fs.ls(SNAPSHOT_DIR, detail=False):
+        version = posixpath.basename(path.rstrip("/"))
+        if version != LATEST and fs.exists(_path(version, MANIFEST)):
+            versions.append(version)
+    return sorted(versions)
+
+
+def read_manifest(fs, version):
+    with fs.open(_path(version, MANIFEST), "r") as f:
+        return json.load(f)
+
+
+def read_snapshot(fs, version=None):
+    """
+    (version, frames) for version, by default the LATEST one.  The frames come
+    back with the dtypes they were written with.
+    """
+    version = version or latest_version(fs)
+    if version is None:
+        raise FileNotFoundError(f"No user data snapshot in {SNAPSHOT_DIR}; run etl.py first")
+
+    frames = []
+    for name in FRAMES:
+        with fs.open(_path(version, f"{name}.parquet"), "rb") as f:
+            frames.append(arrow_to_pandas(pq.read_table(f)))
+    return version, tuple(frames)
+
+
+def prune(fs, keep):
+    """Delete all but the newest keep versions, never the one LATEST names."""
+    latest = latest_version(fs)
+    versions = list_versions(fs)
+    for version in versions[:-keep]:
+        if version != latest:
+            fs.rm(_path(version), recursive=True)
@@ -0,0 +1,281 @@
+"""
+Generate a synthetic copy of the dashboard's inputs at production-like scale.
+
+Writes the three user parquet caches as dated shards plus the Google / Facebook
+ads tables in the layout described in datasources.py, so the whole init
+pipeline can be run and measured offline:
+
+    python synthetic_data.py --users 2000000 --out local_data
+    CL_DATA_BACKEND=local CL_DATA_DIR=local_data streamlit run main.py
+
+The data is random but shaped like the real thing: users spread over campaign
+cohorts, a small share of test sources and misspelled languages, users that
+show up under several languages, progress rows missing from app launch, and
+campaigns that were renamed part way through their spend.
+"""
+import argparse
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datasources import BIGQUERY_DIR, get_offline_filesystem
+
+CACHE_DIR = "user_data_parquet_cache"
+FIRST_DATE = dt.date(2024, 11, 8)
+
+LANGUAGES = {
+    # language: max_game_level
+    "english": 155, "swahili": 120, "hindi": 110, "french": 140, "arabic": 100,
+    "portuguese": 130, "spanish": 150, "ukrainian": 90, "malagasy": 80, "farsi": 95,
+    "zulu": 70, "bengali": 85,
+}
+# Spellings seen in the raw events that clean_language_column repairs
+MISSPELLED = {"ukrainian": "ukranian", "malagasy": "malgache", "arabic": "arabictest", "farsi": "farsitest"}
+
+COUNTRIES = [
+    "India", "Kenya", "Nigeria", "Brazil", "Pakistan", "Egypt", "Madagascar", "Ukraine",
+    "Iran", "South Africa", "Bangladesh", "Mexico", "Tanzania", "Ethiopia", "Philippines",
+    "United States", "France", "Colombia", "Morocco", "Uganda",
+]
+CITIES = ["(not set)", "Nairobi", "Lagos", "Delhi", "Cairo", "Dhaka", "Lima", "Kampala"]
+TEST_SOURCES = ["testingSource", "QAtest", "DSS-Botswana", "testRajesh", "faceboaok"]
+EVENT_ORDER = ["download_completed", "tapped_start", "selected_level", "puzzle_completed", "level_completed"]
+
+
+def _days(start, end):
+    return (end - start).days + 1
+
+
+def make_campaigns(rng, n_campaigns, start, end):
+    languages = np.array(list(LANGUAGES))
+    campaign_ids = np.unique(rng.integers(10**10, 10**11, size=n_campaigns * 2))[:n_campaigns]
+    campaign_ids = rng.permutation(campaign_ids).astype(str)
+    platform = rng.choice(["google", "facebook"], size=n_campaigns, p=[0.4, 0.6])
+    language = rng.choice(languages, size=n_campaigns)
+    country = rng.choice(COUNTRIES, size=n_campaigns)
+    total_days = _days(start, end)
+    first_day = rng.integers(0, max(total_days - 14, 1), size=n_campaigns)
+    length = rng.integers(14, 240, size=n_campaigns)
+    last_day = np.minimum(first_day + length, total_days - 1)
+    source_id = np.where(platform == "google", "google", "facebook")
+    partner = rng.random(n_campaigns) < 0.15
+    source_id = np.where(partner, np.char.add("partner", rng.integers(1, 30, n_campaigns).astype(str)), source_id)
+    return pd.DataFrame({
+        "campaign_id": campaign_ids,
+        "platform": platform,
+        "app_language": language,
+        "country": country,
+        "source_id": source_id,
+        "first_day": first_day,
+        "last_day": last_day,
+        "daily_budget": rng.gamma(2.0, 25.0, n_campaigns).round(2),
+        "tracked": rng.random(n_campaigns) >= 0.1,
+        "renamed": rng.random(n_campaigns) < 0.1,
+    })
+
+
+def campaign_name(row, old=False):
+    prefix = "FTM Legacy" if old else "Feed The Monster"
+    return f"{prefix}: {row.app_language.title()} - {row.country} Campaign"
+
+
+def make_ads_frames(rng, campaigns, start):
+    frames = {}
+    tracked = campaigns[campaigns["tracked"]]
+    for platform, group in tracked.groupby("platform"):
+        lengths = (group["last_day"] - group["first_day"] + 1).to_numpy()
+        idx = np.repeat(np.arange(len(group)), lengths)
+        offset = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        day = group["first_day"].to_numpy()[idx] + offset
+        rows = group.iloc[idx].reset_index(drop=True)
+        names = np.array([campaign_name(r) for r in group.itertuples()])[idx]
+        old_names = np.array([campaign_name(r, old=True) for r in group.itertuples()])[idx]
+        midpoint = (group["first_day"].to_numpy() + lengths // 2)[idx]
+        names = np.where(rows["renamed"].to_numpy() & (day < midpoint), old_names, names)
+        cost = rows["daily_budget"].to_numpy() * rng.uniform(0.5, 1.5, len(rows))
+        segment_date = pd.to_datetime(start) + pd.to_timedelta(day, unit="D")
+        if platform == "google":
+            frames[platform] = pd.DataFrame({
+                "campaign_id": rows["campaign_id"].astype("int64"),
+                "segment_date": segment_date.date,
+                "campaign_name": names,
+                "cost": (cost * 1_000_000).astype("int64"),
+            })
+        else:
+            # data_date_start is a TIMESTAMP in facebook_ads_data, so it
+            # arrives UTC-aware
+            frames[platform] = pd.DataFrame({
+                "campaign_id": rows["campaign_id"],
+                "segment_date": segment_date.tz_localize("UTC"),
+                "campaign_name": names,
+                "cost": cost.round(2),
+            })
+    return frames
+
+
+def make_user_shard(rng, campaigns, user_offset, n_users, day_lo, day_hi, start):
+    """One shard's worth of app launch, progress and unattributed rows."""
+    # Users arrive on days campaigns were running
+    campaign_idx = rng.integers(0, len(campaigns), n_users)
+    day = rng.integers(day_lo, day_hi, n_users)
+    c = campaigns.iloc[campaign_idx]
+
+    ids = np.arange(user_offset, user_offset + n_users)
+    cr_user_id = np.char.add("cr", ids.astype(str))
+    user_pseudo_id = np.char.add("ps", ids.astype(str))
+    first_open = (pd.to_datetime(start) + pd.to_timedelta(day, unit="D")).date
+    language = c["app_language"].to_numpy().copy()
+    country = c["country"].to_numpy().copy()
+    drift = rng.random(n_users) < 0.08
+    country[drift] = rng.choice(COUNTRIES, drift.sum())
+    source_id = c["source_id"].to_numpy().copy()
+    is_test = rng.random(n_users) < 0.005
+    source_id[is_test] = rng.choice(TEST_SOURCES, is_test.sum())
+    raw_language = language.copy()
+    for good, bad in MISSPELLED.items():
+        hit = (raw_language == good) & (rng.random(n_users) < 0.2)
+        raw_language[hit] = bad
+    event_lag = rng.choice([0, 0, 0, 1, 2], n_users)
+    event_date = (pd.to_datetime(start) + pd.to_timedelta(day + event_lag, unit="D")).strftime("%Y%m%d").to_numpy()
+
+    app_launch = pd.DataFrame({
+        "user_pseudo_id": user_pseudo_id,
+        "cr_user_id": cr_user_id,
+        "event_date": event_date,
+        "country": country,
+        "campaign_id": c["campaign_id"].to_numpy(),
+        "source_id": source_id,
+        "app_language": raw_language,
+        "first_open": first_open,
+    })
+
+    # Users that launched under a second language / country on the same device
+    multi = np.flatnonzero(rng.random(n_users) < 0.02)
+    extra = app_launch.iloc[multi].copy()
+    extra["app_language"] = rng.choice(list(LANGUAGES), len(multi))
+    extra["country"] = rng.choice(COUNTRIES, len(multi))
+
+    # Progress: most reached at least download_completed
+    in_progress = rng.random(n_users) < 0.65
+    rank = rng.choice(5, n_users, p=[0.25, 0.2, 0.15, 0.1, 0.3])
+    max_game_level = np.array([LANGUAGES.get(l, 100) for l in language])
+    level = np.where(
+        rank == 4,
+        np.minimum(rng.geometric(0.08, n_users), max_game_level),
+        0,
+    )
+    furthest = np.array(EVENT_ORDER, dtype=object)[rank]
+    furthest[rng.random(n_users) < 0.003] = None
+    progress_first_open = np.where(rng.random(n_users) < 0.01,
+                                   (pd.to_datetime(first_open) - pd.Timedelta(days=1)).date,
+                                   first_open)
+    progress = pd.DataFrame({
+        "user_pseudo_id": user_pseudo_id,
+        "cr_user_id": cr_user_id,
+        "first_open": progress_first_open,
+        "event_date": first_open,
+        "country": country,
+        "app_language": raw_language,
+        "campaign_id": c["campaign_id"].to_numpy(),
+        "source_id": source_id,
+        "max_user_level": level,
+        "max_game_level": max_game_level,
+        "la_date": np.where(level > 0, first_open, None),
+        "furthest_event": furthest,
+        "gpc": level / max_game_level * 100,
+    })
+    extra_progress = progress.iloc[multi].copy()
+    extra_progress["app_language"] = extra["app_language"].to_numpy()
+    extra_progress["country"] = extra["country"].to_numpy()
+    extra_progress["max_user_level"] = rng.integers(0, 5, len(multi))
+    extra_progress["furthest_event"] = np.array(EVENT_ORDER, dtype=object)[rng.integers(0, 5, len(multi))]
+    keep = in_progress.copy()
+    # A few progress users never made it into the app launch data
+    orphan = rng.random(n_users) < 0.005
+    progress = pd.concat([progress[keep], extra_progress[keep[multi]]], ignore_index=True)
+    app_launch = pd.concat([app_launch[~orphan], extra], ignore_index=True)
+
+    n_unattributed = int(n_users * 0.8)
+    u_day = rng.integers(day_lo, day_hi, n_unattributed)
+    u_ids = np.char.add("un", np.arange(user_offset, user_offset + n_unattributed).astype(str))
+    unattributed = pd.DataFrame({
+        "user_pseudo_id": np.char.add("ups", u_ids),
+        "event_date": (pd.to_datetime(start) + pd.to_timedelta(u_day, unit="D")).strftime("%Y%m%d").to_numpy(),
+        "cr_user_id": u_ids,
+        "country": rng.choice(COUNTRIES, n_unattributed),
+        "city": rng.choice(CITIES, n_unattributed),
+        "region": "(not set)",
+        "traffic_source_name": rng.choice(["(direct)", "(organic)", "(referral)"], n_unattributed),
+        "traffic_source_source": rng.choice(["(direct)", "google", "play.google.com"], n_unattributed),
+        "app_language": rng.choice(list(LANGUAGES), n_unattributed),
+        "first_open": (pd.to_datetime(start) + pd.to_timedelta(u_day, unit="D")).date,
+    })
+    return app_launch, progress, unattributed
+
+
+def _write(fs, path, df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with fs.open(path, "wb") as f:
+        pq.write_table(table, f, row_group_size=256_000)
+
+
+def generate(fs, users=100_000, start=FIRST_DATE, end=None, shard_days=7, seed=0):
+    """Write a full synthetic dataset into fs and return a summary of row counts."""
+    end = end or dt.date.today()
+    rng = np.random.default_rng(seed)
+    n_campaigns = int(np.clip(users // 2_000, 20, 5_000))
+    campaigns = make_campaigns(rng, n_campaigns, start, end)
+
+    fs.makedirs(CACHE_DIR, exist_ok=True)
+    fs.makedirs(BIGQUERY_DIR, exist_ok=True)
+
+    total_days = _days(start, end)
+    shard_starts = list(range(0, total_days, shard_days))
+    per_shard = np.diff(np.linspace(0, users, len(shard_starts) + 1).astype(int))
+    counts = {"cr_app_launch_campaign_data": 0, "cr_user_progress_campaign_data": 0,
+              "unattributed_app_launch_events": 0}
+    offset = 0
+    for shard_start, n_users in zip(shard_starts, per_shard):
+        if n_users == 0:
+            continue
+        shard_end = min(shard_start + shard_days, total_days)
+        frames = make_user_shard(rng, campaigns, offset, n_users, shard_start, shard_end, start)
+        offset += n_users
+        suffix = (start + dt.timedelta(days=shard_start)).strftime("%Y%m%d")
+        for name, df in zip(counts, frames):
+            _write(fs, f"{CACHE_DIR}/{name}_{suffix}.parquet", df)
+            counts[name] += len(df)
+
+    ads = make_ads_frames(rng, campaigns, start)
+    _write(fs, f"{BIGQUERY_DIR}/p_ads_CampaignStats_6687569935.parquet", ads["google"])
+    _write(fs, f"{BIGQUERY_DIR}/facebook_ads_data.parquet", ads["facebook"])
+    _write(fs, f"{BIGQUERY_DIR}/language_max_level.parquet",
+           pd.DataFrame({"display_language": [l.title() for l in LANGUAGES]}))
+    _write(fs, f"{BIGQUERY_DIR}/active_countries.parquet",
+           pd.DataFrame({"country": sorted(COUNTRIES)}))
+    counts["google_ads"] = len(ads["google"])
+    counts["facebook_ads"] = len(ads["facebook"])
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000, help="attributed users to generate")
+    parser.add_argument("--out", default="local_data", help="output directory (local backend)")
+    parser.add_argument("--backend", default="local", choices=["local", "memory"])
+    parser.add_argument("--start", type=dt.date.fromisoformat, default=FIRST_DATE)
+    parser.add_argument("--end", type=dt.date.fromisoformat, default=None)
+    parser.add_argument("--shard-days", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    fs = get_offline_filesystem(args.backend, args.out if args.backend == "local" else None)
+    counts = generate(fs, args.users, args.start, args.end, args.shard_days, args.seed)
+    for name, rows in counts.items():
+        print(f"{name}: {rows:,} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+from opentelemetry import context, metrics, trace
+
+# Per-stage timings for the data pipeline and the page reruns, as OpenTelemetry
+# spans and one duration histogram:
+#
+#   with telemetry.stage("users.single_language"):
+#       ...
+#
+# opens a span named after the stage (stages inside it become its children)
+# and records the stage's wall time in milliseconds in the cl.stage.duration
+# histogram, with the stage name as its cl.stage attribute, so each stage can
+# be graphed on its own.  measure() only records the histogram, for steps run
+# once per record batch where a span each would flood the exporter.
+#
+# Nothing is exported until configure() installs an exporter, chosen by
+# CL_TELEMETRY_EXPORTER:
+#   "none"     (default) stages cost a no-op span and histogram
+#   "console"  spans printed to stdout as they end, metrics every
+#              OTEL_METRIC_EXPORT_INTERVAL ms (default 60000) and at exit
+#   "file"     the same as one JSON document per line, appended to
+#              CL_TELEMETRY_FILE (default telemetry.jsonl)
+#   "otlp"     an OTLP/HTTP collector, set up with the standard
+#              OTEL_EXPORTER_OTLP_* variables (needs
+#              opentelemetry-exporter-otlp-proto-http)
+# More exporters can be added to EXPORTERS.
+
+EXPORTER_ENV = "CL_TELEMETRY_EXPORTER"
+FILE_ENV = "CL_TELEMETRY_FILE"
+DEFAULT_FILE = "telemetry.jsonl"
+SERVICE_NAME = "cl-dashboard-campaigns"
+
+DURATION = "cl.stage.duration"
+STAGE_ATTRIBUTE = "cl.stage"
+# Histogram buckets (ms) from a page filter to a cold user data load
+DURATION_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1_000, 2_500, 5_000,
+                    10_000, 30_000, 60_000, 120_000, 300_000]
+
+_tracer = trace.get_tracer(__name__)
+_duration = metrics.get_meter(__name__).create_histogram(
+    DURATION, unit="ms", description="Wall time of a dashboard pipeline or page stage")
+
+
+def _console_exporters():
+    from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    return ConsoleSpanExporter(), ConsoleMetricExporter()
+
+
+def _file_exporters():
+    from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    out = open(os.environ.get(FILE_ENV, DEFAULT_FILE), "a", buffering=1)
+    return (ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n"),
+            ConsoleMetricExporter(out=out, formatter=lambda data: data.to_json(indent=None) + "\n"))
+
+
+def _otlp_exporters():
+    from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+    return OTLPSpanExporter(), OTLPMetricExporter()
+
+
+# Exporter name -> function returning (span exporter, metric exporter)
+EXPORTERS = {
+    "console": _console_exporters,
+    "file": _file_exporters,
+    "otlp": _otlp_exporters,
+}
+
+_configure_lock = threading.Lock()
+_configured = None
+
+
+def configure(exporter=None):
+    """
+    Install the named exporter (CL_TELEMETRY_EXPORTER when not given) for the
+    process.  Only the first call installs one; it returns the name in use.
+    """
+    global _configured
+    with _configure_lock:
+        if _configured is not None:
+            return _configured
+        name = (exporter or os.environ.get(EXPORTER_ENV) or "none").lower()
+        if name != "none":
+            if name not in EXPORTERS:
+                raise ValueError(f"Unknown telemetry exporter {name!r} ({EXPORTER_ENV}), "
+                                 f"expected none or one of {', '.join(EXPORTERS)}")
+            _install(*EXPORTERS[name](), immediate=name == "console")
+        _configured = name
+        return name
+
+
+def _install(span_exporter, metric_exporter, immediate=False):
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+    from opentelemetry.sdk.metrics.view import ExplicitBucketHistogramAggregation, View
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+
+    resource = Resource.create({"service.name": SERVICE_NAME, "process.command": sys.argv[0]})
+
+    tracer_provider = TracerProvider(resource=resource)
+    processor = SimpleSpanProcessor if immediate else BatchSpanProcessor
+    tracer_provider.add_span_processor(processor(span_exporter))
+    trace.set_tracer_provider(tracer_provider)
+
+    metrics.set_meter_provider(MeterProvider(
+        resource=resource,
+        metric_readers=[PeriodicExportingMetricReader(metric_exporter)],
+        views=[View(instrument_name=DURATION,
+                    aggregation=ExplicitBucketHistogramAggregation(DURATION_BUCKETS))],
+    ))
+
+
+def _record(name, start):
+    _duration.record((time.perf_counter() - start) * 1000, {STAGE_ATTRIBUTE: name})
+
+
+@contextlib.contextmanager
+def stage(name, **attributes):
+    """Span called name around the block, its wall time recorded in the stage histogram."""
+    with _tracer.start_as_current_span(name, attributes=attributes) as span:
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            _record(name, start)
+
+
+@contextlib.contextmanager
+def measure(name):
+    """The block's wall time recorded in the stage histogram, without a span."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, start)
+
+
+def bind(fn):
+    """fn running in the caller's trace context, for work handed to another thread."""
+    ctx = context.get_current()
+
+    def run(*args, **kwargs):
+        token = context.attach(ctx)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            context.detach(token)
+
+    return run
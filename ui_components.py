@@ -1,9 +1,9 @@
 
 import streamlit as st
-from rich import print
+import numpy as np
 import plotly.graph_objects as go
 from millify import prettify
-from metrics import get_cohort_totals_by_metric
+from metrics import compute_funnel
 
 
 def create_engagement_figure(funnel_data=[], key=""):
@@ -41,54 +41,54 @@ def create_engagement_figure(funnel_data=[], key=""):
     return fig
 
 
-@st.cache_data(ttl="1d", show_spinner=False)
+# Daily series longer than this are drawn with WebGL traces, and series with
+# more points than MAX_LINE_POINTS are downsampled (see downsample_min_max)
+WEBGL_MIN_POINTS = 366
+MAX_LINE_POINTS = 2000
+
+
+def downsample_min_max(y, max_points=MAX_LINE_POINTS):
+    """
+    Positions of the points of y to draw so the line keeps its shape: y is
+    cut into max_points // 4 equal buckets and the first, last, lowest and
+    highest point of each kept, in order.  All positions if y is short enough.
+    """
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    buckets = max_points // 4
+    bucket = np.arange(n) * buckets // n
+    starts = np.searchsorted(bucket, np.arange(buckets))
+    ends = np.append(starts[1:], n)
+
+    by_value = np.lexsort((y, bucket))
+    keep = np.concatenate([starts, ends - 1, by_value[starts], by_value[ends - 1]])
+    return np.unique(keep)
+
+
+def daily_trace(daily_df, name):
+    """Line trace of a (event_date, event_count) frame, downsampled and on WebGL when long."""
+    counts = daily_df["event_count"].to_numpy()
+    keep = downsample_min_max(counts)
+    trace = go.Scattergl if len(daily_df) > WEBGL_MIN_POINTS else go.Scatter
+    return trace(
+        x=daily_df["event_date"].to_numpy()[keep],
+        y=counts[keep],
+        mode="lines+markers",
+        name=name,
+        hovertemplate="Date: %{x|%Y-%m-%d}<br>Event Count: %{y:,}<extra></extra>",
+    )
+
+
 def unattributed_events_line_chart(unattributed_df,
                                    attributed_df,
                                    ):
-
-
-    #Group and format 
-    attributed_df = attributed_df.groupby(
-        'event_date').size().reset_index(name='event_count')
-    
-    unattributed_df = unattributed_df.groupby(
-        'event_date').size().reset_index(name='event_count')
-
-
-    # Format event_count with commas for hover text
-    unattributed_df["formatted_event_count"] = unattributed_df["event_count"].apply(lambda x: f"{
-                                                                       x:,}")
-    attributed_df["formatted_event_count"] = attributed_df["event_count"].apply(
-        lambda x: f"{x:,}")
+    """Per-day counts (event_date, event_count), see metrics.get_event_summary."""
 
     # Create the figure
     fig = go.Figure()
-
-    # Unattributed trace
-    fig.add_trace(go.Scatter(
-        x=unattributed_df["event_date"],
-        y=unattributed_df["event_count"],
-        mode="lines+markers",
-        name="Unattributed Count per Day",
-        text=unattributed_df.apply(
-            lambda row: f"Date: {row['event_date'].strftime(
-                '%Y-%m-%d')}<br>Event Count: {row['formatted_event_count']}",
-            axis=1),
-        hoverinfo="text"
-    ))
-
-    # Attributed trace
-    fig.add_trace(go.Scatter(
-        x=attributed_df["event_date"],
-        y=attributed_df["event_count"],
-        mode="lines+markers",
-        name="Attributed Count per Day",
-        text=attributed_df.apply(
-            lambda row: f"Date: {row['event_date'].strftime(
-                '%Y-%m-%d')}<br>Event Count: {row['formatted_event_count']}",
-            axis=1),
-        hoverinfo="text"
-    ))
+    fig.add_trace(daily_trace(unattributed_df, "Unattributed Count per Day"))
+    fig.add_trace(daily_trace(attributed_df, "Attributed Count per Day"))
 
     # Customize layout
     fig.update_layout(
@@ -103,11 +103,8 @@ def unattributed_events_line_chart(unattributed_df,
     st.plotly_chart(fig, use_container_width=True)
     
 
-def country_pie_chart(df):
-
-# Grouping and counting entries for each country
-    grouped_df = df.groupby(
-    'country').size().reset_index(name='count')
+def country_pie_chart(grouped_df):
+    """Entries per country (country, count), see metrics.get_event_summary."""
 
 # Calculating the total number of entries
     total_count = grouped_df['count'].sum()
@@ -139,27 +136,21 @@ def create_funnels_by_cohort(
     key_prefix="",
     funnel_size="medium",
     cohort_df_LR=None,
+    funnel=None,
 ):
+    """
+    Draw the funnel for a cohort.  Pass precomputed FunnelCounts as `funnel`
+    to skip counting the cohort frames.
+    """
 
-    stats = ["LR", "DC", "TS", "SL", "PC", "LA", "RA", "GC"]
     titles = [
         "Learner Reached", "Download Completed", "Tapped Start",
         "Selected Level", "Puzzle Completed", "Learners Acquired", "Readers Acquired", "Game Completed"
     ]
 
-    user_key = "cr_user_id"
-
-    funnel_step_counts = []
-    for stat in stats:
-        if stat == "LR":
-            count = (
-                cohort_df_LR[user_key].nunique()
-                if cohort_df_LR is not None and user_key in cohort_df_LR.columns
-                else cohort_df[user_key].nunique()
-            )
-        else:
-            count = get_cohort_totals_by_metric(cohort_df, stat=stat)
-        funnel_step_counts.append(count)
+    if funnel is None:
+        funnel = compute_funnel(cohort_df, cohort_df_LR)
+    funnel_step_counts = funnel.counts()
 
     # --- Percentages ---
     percent_of_previous = [None]
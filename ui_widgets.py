@@ -1,9 +1,9 @@
 import streamlit as st
 import datetime as dt
-from dateutil.relativedelta import relativedelta
 import calendar
 import re
-from streamlit_option_menu import option_menu
+import numpy as np
+from versioned_cache import freeze, versioned_cache
 
 min_date = dt.date(2024, 11, 8)
 
@@ -146,14 +146,96 @@ def multi_select_all(available_options,title="", key="key"):
     )  # Return full list if "All" is selected
 
 
-@st.cache_data(show_spinner=False)
-def split_frame(input_df, rows):
-    df = [input_df.iloc[i : i + rows - 1, :] for i in range(0, len(input_df), rows)]
-    return df
+def page_count(total_rows, page_size):
+    return max(1, -(-total_rows // page_size))
 
 
-def paginated_dataframe(df, keys):
+def page_bounds(total_rows, page_size, page):
+    """Row range [start, stop) of a 1-based page."""
+    start = (page - 1) * page_size
+    return start, min(start + page_size, total_rows)
+
+
+def sort_order(values, ascending=True):
+    """Row positions of values in sorted order, ties in table order, missing last."""
+    values = values.reset_index(drop=True)
+    return values.sort_values(ascending=ascending, na_position="last", kind="stable").index.to_numpy()
+
+
+class VersionedTable:
+    """A table built from versioned data, with a version identifying its content."""
+
+    def __init__(self, frame, version):
+        self.frame = frame
+        self.version = freeze(version)
+
+
+@versioned_cache(maxsize=32)
+def table_sort_order(table, column, ascending=True):
+    """
+    sort_order of one column of a VersionedTable, cached per (table version,
+    column, direction) so paging through a sorted table does not sort it again
+    on every rerun.  The positions are read-only.
+    """
+    order = sort_order(table.frame[column], ascending=ascending)
+    order.setflags(write=False)
+    return order
+
+
+def filter_order(values, text, order=None):
+    """The positions in order (default all rows) whose value contains text, ignoring case."""
+    matches = values.astype(str).str.contains(text, case=False, regex=False, na=False).to_numpy()
+    if order is None:
+        return np.flatnonzero(matches)
+    return order[matches[order]]
+
+
+@versioned_cache(enabled=False)  # slicing is cheaper than hashing the table
+def split_frame(input_df, rows, page=1, order=None):
+    """
+    Page page (1-based) of input_df, rows rows per page, taking the rows in
+    order (positions, default table order).  Only that page's rows are copied.
+    """
+    total_rows = len(input_df) if order is None else len(order)
+    start, stop = page_bounds(total_rows, rows, page)
+    if order is None:
+        return input_df.iloc[start:stop]
+    return input_df.iloc[order[start:stop]]
+
+
+def paginated_dataframe(df, keys, version=None):
+    """
+    df with sort, filter and paging controls.  version, when given, identifies
+    df's content (e.g. the data versions and selections it was built from), and
+    the sort order is then computed once per version, column and direction.
+    """
     top_menu = st.columns(3)
+    with top_menu[0]:
+        sort = st.radio("Sort Data", options=["No", "Yes"], horizontal=True, index=0, key=keys[0])
+    if sort == "Yes":
+        with top_menu[1]:
+            sort_field = st.selectbox("Sort By", options=df.columns, key=keys[1])
+        with top_menu[2]:
+            sort_direction = st.radio("Direction", options=["⬆️", "⬇️"], horizontal=True, key=keys[2])
+
+    with st.expander("Filter"):
+        filter_columns = st.columns((1, 2))
+        with filter_columns[0]:
+            filter_field = st.selectbox("Column", options=df.columns, key=f"{keys[0]}-filter-field")
+        with filter_columns[1]:
+            filter_text = st.text_input("Contains", key=f"{keys[0]}-filter-text")
+
+    # Sorting and filtering only compute the order of the row positions;
+    # the table itself is never reordered or copied
+    order = None
+    if sort == "Yes":
+        if version is not None:
+            order = table_sort_order(VersionedTable(df, version), sort_field, ascending=sort_direction == "⬆️")
+        else:
+            order = sort_order(df[sort_field], ascending=sort_direction == "⬆️")
+    if filter_text:
+        order = filter_order(df[filter_field], filter_text, order)
+    total_rows = len(df) if order is None else len(order)
 
     pagination = st.container()
     bottom_menu = st.columns((4, 1, 1))
@@ -162,16 +244,18 @@ def paginated_dataframe(df, keys):
             "Page Size", options=[500, 1000, 1500], key=keys[3], index=0
         )
     with bottom_menu[1]:
-        total_pages = int(len(df) / batch_size) if int(len(df) / batch_size) > 0 else 1
+        total_pages = page_count(total_rows, batch_size)
+        # A filter or a larger page size can leave the last page shown past the end
+        if st.session_state.get(keys[4], 1) > total_pages:
+            st.session_state[keys[4]] = total_pages
         current_page = st.number_input(
             "Page", min_value=1, max_value=total_pages, step=1, key=keys[4]
         )
     with bottom_menu[0]:
         st.markdown(f"Page **{current_page}** of **{total_pages}** ")
 
-    pages = split_frame(df, batch_size)
     pagination.dataframe(
-        hide_index=True, data=pages[current_page - 1], use_container_width=True
+        hide_index=True, data=split_frame(df, batch_size, current_page, order), use_container_width=True
     )
 
 def stats_radio_selector():
@@ -227,6 +311,8 @@ presets = [
 
 
 def presets_selector(key="", index=1):
+    from streamlit_option_menu import option_menu
+
     dates = []
     icons = ["peace", "yin-yang", "sun", "heart"]
     styles = {
@@ -1,9 +1,22 @@
 import streamlit as st
 import pandas as pd
-from rich import print as print
 import numpy as np
-import gcsfs
-from  settings import get_gcp_credentials
+import datetime as dt
+from dataclasses import dataclass
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasources import get_backend, get_filesystem
+from query_executor import get_query_executor
+from refresher import get_refresher
+from shard_cache import MemoryBudget, get_shard_cache
+from cohort_cube import build_cohort_cube
+from cohort_index import CohortIndex
+from versioned_cache import versioned_cache
+from schema import (EVENT_ORDER, apply_schema, app_launch_schema, arrow_to_pandas, progress_schema,
+                    unattributed_schema)
+import event_rollup
+import snapshots
+import telemetry
 
 start_date = '2024-05-01'
 # Starting 05/01/2024, campaign names were changed to support an indication of
@@ -13,175 +26,332 @@ start_date = '2024-05-01'
 sources_to_remove = ['testingSource', 'DSS-Botswana', 'QAtestfacebook', 'test',"QAtest", "testRajesh", "testNikhil", "testNikhil2"
 ]
 
-@st.cache_data(ttl="1d", show_spinner=False)
-def load_parquet_from_gcs(file_pattern: str) -> pd.DataFrame:
-    credentials, _ = get_gcp_credentials()
-    fs = gcsfs.GCSFileSystem(project="dataexploration-193817", token=credentials)
-    files = fs.glob(file_pattern)
-    if not files:
-        raise FileNotFoundError(f"No files matching pattern: {file_pattern}")
-    df = pd.read_parquet(files, filesystem=fs).copy()
+# Sources dropped from the user data at load time, along with any source_id
+# containing excluded_source_pattern (case insensitive)
+excluded_sources = ["DSS-Botswana", "faceboaok"]
+excluded_source_pattern = r"test"
+
+# Only the columns the dashboard reads are decoded from the parquet caches
+app_launch_columns = ["user_pseudo_id", "cr_user_id", "event_date", "country",
+                      "campaign_id", "source_id", "app_language", "first_open"]
+progress_columns = ["cr_user_id", "first_open", "country", "app_language",
+                    "campaign_id", "source_id", "max_user_level", "furthest_event", "gpc"]
+unattributed_columns = ["event_date", "country", "app_language"]
+
+# Low-cardinality columns kept dictionary-encoded from the first batch on
+dictionary_columns = ["country", "app_language", "campaign_id", "source_id"]
+
+# Language spellings seen in the raw events
+language_fixes = {
+    "ukranian": "ukrainian",
+    "malgache": "malagasy",
+    "arabictest": "arabic",
+    "farsitest": "farsi"
+}
+
+
+def campaign_user_filter():
+    """
+    Arrow filter matching the rows init_user_data keeps: first_open on or after
+    start_date and a source_id that is not excluded.  Pushed down into the
+    parquet reads so excluded rows are never decoded.
+    """
+    source = pc.field("source_id")
+    excluded = source.isin(excluded_sources) | pc.match_substring(
+        source, excluded_source_pattern, ignore_case=True)
+    return (
+        (pc.field("first_open") >= pa.scalar(dt.date.fromisoformat(start_date)))
+        & (source.is_null() | ~excluded)
+    )
+
+
+def compact_batch(batch):
+    """
+    Smaller types for a freshly read record batch: YYYYMMDD event_date strings
+    as date32 and the dictionary_columns dictionary-encoded.
+    """
+    columns = {}
+    for name, values in zip(batch.schema.names, batch.columns):
+        if name == "event_date" and pa.types.is_string(values.type):
+            # Also when there is no row to go by, so every batch gets one type
+            sample = values.drop_null()
+            if not len(sample) or len(sample[0].as_py()) == 8:
+                values = pc.strptime(values, format="%Y%m%d", unit="s", error_is_null=True).cast(pa.date32())
+        elif name in dictionary_columns and not pa.types.is_dictionary(values.type):
+            values = pc.dictionary_encode(values)
+        columns[name] = values
+    return pa.RecordBatch.from_pydict(columns)
+
+
+def clean_campaign_user_batch(batch):
+    """
+    Load-time cleanup of the campaign user data, applied to each record batch
+    as it is read: first_open as a timestamp, rows before start_date or from an
+    excluded source dropped, language spellings repaired, then compact_batch.
+    """
+    with telemetry.measure("users.batch.date_fix"):
+        first_open = to_timestamp(batch.column("first_open"))
+        batch = batch.set_column(batch.schema.get_field_index("first_open"), "first_open", first_open)
+
+    with telemetry.measure("users.batch.source_filter"):
+        # Filter by start_date
+        keep = pc.greater_equal(first_open, pa.scalar(pd.Timestamp(start_date), first_open.type))
+
+        # Source removals (also pushed down into the parquet reads)
+        if "source_id" in batch.schema.names:
+            source = batch.column("source_id")
+            excluded = pc.or_kleene(
+                pc.is_in(source, value_set=pa.array(excluded_sources)),
+                pc.match_substring_regex(source, excluded_source_pattern, ignore_case=True))
+            keep = pc.and_kleene(keep, pc.or_kleene(source.is_null(), pc.invert(excluded)))
+        batch = batch.filter(keep)
+
+    # Clean language
+    with telemetry.measure("users.batch.language_fix"):
+        batch = batch.set_column(batch.schema.get_field_index("app_language"), "app_language",
+                                 clean_language_values(batch.column("app_language")))
+    with telemetry.measure("users.batch.compact"):
+        return compact_batch(batch)
+
+
+def rollup_unattributed_batch(batch):
+    """compact_batch, then the batch's launch count per (event_date, country, app_language)."""
+    return event_rollup.rollup_batch(compact_batch(batch), event_rollup.UNATTRIBUTED_KEYS)
+
+
+def load_parquet_from_gcs(file_pattern: str, columns=None, filters=None, transform=compact_batch,
+                          budget=None) -> pd.DataFrame:
+    # Only shards that are new or changed since the last refresh are downloaded
+    # and decoded, see shard_cache.py.  Not st.cache_data: the result is only
+    # read by build_user_dataset, which is itself cached process-wide.
+    with telemetry.stage("users.load", pattern=file_pattern):
+        cache = get_shard_cache(get_filesystem(), get_backend())
+        table = cache.load(file_pattern, columns=columns, filter=filters, transform=transform, budget=budget)
+
+        # Strings and dates stay in their Arrow buffers
+        df = arrow_to_pandas(table)
 
     return df
 
 
-def load_cr_user_progress_campaign_data_from_gcs():
-    return load_parquet_from_gcs("user_data_parquet_cache/cr_user_progress_campaign_data_*.parquet")
+def load_cr_user_progress_campaign_data_from_gcs(budget=None):
+    return load_parquet_from_gcs("user_data_parquet_cache/cr_user_progress_campaign_data_*.parquet",
+                                 columns=progress_columns, filters=campaign_user_filter(),
+                                 transform=clean_campaign_user_batch, budget=budget)
+
+def load_cr_app_launch_campaign_data_from_gcs(budget=None):
+    return load_parquet_from_gcs("user_data_parquet_cache/cr_app_launch_campaign_data_*.parquet",
+                                 columns=app_launch_columns, filters=campaign_user_filter(),
+                                 transform=clean_campaign_user_batch, budget=budget)
+
+def load_unattributed_app_launch_events_from_gcs(budget=None):
+    # Only the daily counts are kept, see event_rollup.py
+    return load_parquet_from_gcs("user_data_parquet_cache/unattributed_app_launch_events_*.parquet",
+                                 columns=unattributed_columns, transform=rollup_unattributed_batch,
+                                 budget=budget)
+
+
+@dataclass(frozen=True)
+class UserDataset:
+    """
+    The cleaned user frames, built once per refresh and shared by every session.
+    Column types follow schema.py.  Treat the frames as read-only: filter or
+    copy them, never assign into them.
+    """
+    version: str
+    campaign_users_progress: pd.DataFrame
+    campaign_users_app_launch: pd.DataFrame
+    unattributed_rollup: pd.DataFrame  # launches per (event_date, country, app_language)
+    cohort_cube: pd.DataFrame
+    app_launch_index: CohortIndex
+    progress_index: CohortIndex
+    attributed_rollup: pd.DataFrame  # launches per (event_date, country, app_language, source_id)
 
-def load_cr_app_launch_campaign_data_from_gcs():
-    return load_parquet_from_gcs("user_data_parquet_cache/cr_app_launch_campaign_data_*.parquet")
 
-def load_unattributed_app_launch_events_from_gcs():
-    return load_parquet_from_gcs("user_data_parquet_cache/unattributed_app_launch_events_*.parquet")
+@st.cache_resource(show_spinner="Loading User Data")
+def get_user_data_refresher():
+    """
+    Process-wide Refresher for the UserDataset: the first load happens here,
+    later ones in the background (see refresher.py).
+    """
+    return get_refresher("user data", refresh_user_dataset)
+
+
+def get_user_dataset():
+    """Process-wide UserDataset, the latest version fully built."""
+    return get_user_data_refresher().get()
 
 
 def ensure_user_data_initialized():
     import traceback
-    """Run init_user_data once per session, with error handling."""
-    if "user_data_initialized" not in st.session_state:
-        try:
-            init_user_data()
-            st.session_state["user_data_initialized"] = True
-        except Exception as e:
-            st.error(f"❌ Failed to initialize user data: {e}")
-            st.text(traceback.format_exc())
-            st.stop()
-
-
-def init_user_data():
-    if st.session_state.get("user_data_initialized"):
-        return  # already initialized this session
-    with st.spinner("Loading User Data", show_time=True):
-        from pyinstrument import Profiler
-        from pyinstrument.renderers.console import ConsoleRenderer
-        import settings
-
-        profiler = Profiler(async_mode="disabled")
-        with profiler:
-            # Cached fast parquet loads
-            campaign_users_app_launch = load_cr_app_launch_campaign_data_from_gcs()
-            campaign_users_progress = load_cr_user_progress_campaign_data_from_gcs()
-            df_unattributed_app_launch_events = load_unattributed_app_launch_events_from_gcs()
-
-            # Validation
-            if campaign_users_app_launch.empty or campaign_users_progress.empty or df_unattributed_app_launch_events.empty:
-                raise ValueError(
-                    "❌ One or more dataframes were empty after loading.")
-
-            # Fix dates and clean
-            campaign_users_progress = fix_date_columns(
-                campaign_users_progress, ["first_open", "last_event_date"])
-            campaign_users_app_launch = fix_date_columns(
-                campaign_users_app_launch, ["first_open"])
-
-            # Filter by start_date
-            campaign_users_progress = campaign_users_progress[
-                campaign_users_progress["first_open"] >= start_date]
-            campaign_users_app_launch = campaign_users_app_launch[
-                campaign_users_app_launch["first_open"] >= start_date]
-
-
-            # Fixed removals
-            sources_to_remove = ["DSS-Botswana","faceboaok"]
-
-            # Regex for dynamic removals
-            pattern = r"test"
-
-            if "source_id" in campaign_users_progress.columns:
-                campaign_users_progress = campaign_users_progress[
-                    ~(
-                        campaign_users_progress["source_id"].isin(sources_to_remove) |
-                        campaign_users_progress["source_id"].str.contains(
-                            pattern, case=False, na=False)
-                    )
-                ]
-
-            if "source_id" in campaign_users_app_launch.columns:
-                campaign_users_app_launch = campaign_users_app_launch[
-                    ~(
-                        campaign_users_app_launch["source_id"].isin(sources_to_remove) |
-                        campaign_users_app_launch["source_id"].str.contains(
-                            pattern, case=False, na=False)
-                    )
-                ]
-
-            # Clean language
-            campaign_users_app_launch["app_language"] = clean_language_column(
-                campaign_users_app_launch)
-            campaign_users_progress["app_language"] = clean_language_column(
-                campaign_users_progress)
-
-            # Drop users missing from app launch
-            missing_users = campaign_users_progress[~campaign_users_progress["cr_user_id"].isin(
-                campaign_users_app_launch["cr_user_id"])]
-            campaign_users_progress = campaign_users_progress[~campaign_users_progress["cr_user_id"].isin(
-                missing_users["cr_user_id"])]
-
-            # Ensure single language per user
-            campaign_users_app_launch, campaign_users_progress = clean_cr_users_to_single_language(
-                campaign_users_app_launch, campaign_users_progress)
-
-            # Assign to session state
-            st.session_state["campaign_users_progress"] = campaign_users_progress
-            st.session_state["campaign_users_app_launch"] = campaign_users_app_launch
-            st.session_state["df_unattributed_app_launch_events"] = df_unattributed_app_launch_events
-            st.session_state["user_data_initialized"] = True
-
-        # Log the profile only once
-        settings.get_logger().debug(
-            profiler.output(ConsoleRenderer(
-                show_all=False, timeline=True, color=True, unicode=True, short_mode=False))
-        )
+    """Make sure the shared user dataset is loaded, with error handling."""
+    try:
+        return get_user_dataset()
+    except Exception as e:
+        st.error(f"❌ Failed to initialize user data: {e}")
+        st.text(traceback.format_exc())
+        st.stop()
+
+
+def load_campaign_user_frames(budget=None):
+    """
+    The three user frames as loaded and cleaned before languages are resolved:
+    (campaign_users_app_launch, campaign_users_progress, unattributed_rollup).
+    Dates, source removals and language spellings are handled batch by batch
+    while reading (clean_campaign_user_batch), and the unattributed launches
+    are counted per day, country and language (rollup_unattributed_batch).
+    """
+    return prepare_campaign_user_frames(
+        load_cr_app_launch_campaign_data_from_gcs(budget),
+        load_cr_user_progress_campaign_data_from_gcs(budget),
+        load_unattributed_app_launch_events_from_gcs(budget),
+    )
+
+
+def prepare_campaign_user_frames(campaign_users_app_launch, campaign_users_progress,
+                                 unattributed_rollup):
+    """Checks and the cross-frame cleanup that has to wait for all rows to be read."""
+    # Validation
+    if campaign_users_app_launch.empty or campaign_users_progress.empty or unattributed_rollup.empty:
+        raise ValueError(
+            "❌ One or more dataframes were empty after loading.")
+
+    # Drop users missing from app launch (compared in Arrow: Series.isin turns
+    # the Arrow strings into Python objects first)
+    in_app_launch = pc.is_in(pa.array(campaign_users_progress["cr_user_id"]),
+                             value_set=pa.array(campaign_users_app_launch["cr_user_id"]))
+    campaign_users_progress = campaign_users_progress[in_app_launch.to_numpy()]
+
+    return campaign_users_app_launch, campaign_users_progress, unattributed_rollup
+
+
+def finish_user_frames(campaign_users_app_launch, campaign_users_progress,
+                       unattributed_rollup):
+    """
+    The shared, schema-typed frames from the prepared ones: one language per
+    user, compact column types, unattributed launch counts in date order.
+    """
+    # Ensure single language per user
+    with telemetry.stage("users.single_language"):
+        campaign_users_app_launch, campaign_users_progress = clean_cr_users_to_single_language(
+            campaign_users_app_launch, campaign_users_progress)
+
+    # Compact, validated column types for the shared frames
+    with telemetry.stage("users.apply_schema"):
+        campaign_users_progress = apply_schema(
+            campaign_users_progress, progress_schema, "campaign_users_progress")
+        campaign_users_app_launch = apply_schema(
+            campaign_users_app_launch, app_launch_schema, "campaign_users_app_launch")
+        unattributed_rollup = apply_schema(
+            unattributed_rollup, unattributed_schema, "unattributed_rollup")
+
+    # One row per (event_date, country, app_language) over all batches, in
+    # date order
+    with telemetry.stage("users.unattributed_rollup"):
+        unattributed_rollup = event_rollup.rollup(unattributed_rollup, event_rollup.UNATTRIBUTED_KEYS)
+
+    return campaign_users_app_launch, campaign_users_progress, unattributed_rollup
+
+
+def make_user_dataset(version, campaign_users_app_launch, campaign_users_progress,
+                      unattributed_rollup):
+    with telemetry.stage("users.cohort_cube"):
+        cohort_cube = build_cohort_cube(campaign_users_app_launch, campaign_users_progress)
+    with telemetry.stage("users.cohort_index"):
+        app_launch_index = CohortIndex(campaign_users_app_launch)
+        progress_index = CohortIndex(campaign_users_progress)
+    with telemetry.stage("users.attributed_rollup"):
+        attributed_rollup = event_rollup.rollup(campaign_users_app_launch, event_rollup.ATTRIBUTED_KEYS)
+
+    return UserDataset(
+        version=version,
+        campaign_users_progress=campaign_users_progress,
+        campaign_users_app_launch=campaign_users_app_launch,
+        unattributed_rollup=unattributed_rollup,
+        cohort_cube=cohort_cube,
+        app_launch_index=app_launch_index,
+        progress_index=progress_index,
+        attributed_rollup=attributed_rollup,
+    )
+
+
+def refresh_user_dataset(current):
+    """The next UserDataset, or current if it is the LATEST snapshot already."""
+    if current is not None and snapshots.enabled() and snapshots.latest_version(get_filesystem()) == current.version:
+        return current
+    return build_user_dataset()
+
+
+def build_user_dataset():
+    import settings
+
+    budget = MemoryBudget()
+    from_snapshot = snapshots.enabled()
+    # Per-stage spans and timings, see telemetry.py
+    with telemetry.stage("users.build", source="snapshot" if from_snapshot else "shards") as span:
+        if from_snapshot:
+            # Frames already cleaned by etl.py
+            with telemetry.stage("users.snapshot_read"):
+                version, frames = snapshots.read_snapshot(get_filesystem())
+        else:
+            version = snapshots.new_version()
+            frames = finish_user_frames(*load_campaign_user_frames(budget))
+        dataset = make_user_dataset(version, *frames)
+        span.set_attribute("version", version)
+
+    settings.get_logger().info(f"User data {version} loaded: {budget.report()}")
+    return dataset
 
 # Language cleanup
-def clean_language_column(df):
-    return df["app_language"].replace({
-        "ukranian": "ukrainian",
-        "malgache": "malagasy",
-        "arabictest": "arabic",
-        "farsitest": "farsi"
-    })
-
-@st.cache_data(ttl="1d", show_spinner=False)
+def clean_language_values(values):
+    """values with the language_fixes spellings replaced (Arrow string array)."""
+    fixed = pc.take(pa.array(list(language_fixes.values())),
+                    pc.index_in(values, value_set=pa.array(list(language_fixes))))
+    return pc.coalesce(fixed, values)
+
+@st.cache_resource(show_spinner=False)
+def get_lookup_refresher():
+    """Process-wide Refresher for the (languages, countries) selector lists, see refresher.py."""
+    return get_refresher("language and country lists",
+                         lambda current: (query_language_list(), query_country_list()))
+
+
 def get_language_list():
-    lang_list = ["All"]
-    _, bq_client = get_gcp_credentials()
+    # A copy: the selectors insert "All" into the list they are given
+    return list(get_lookup_refresher().get()[0])
+
+
+def get_country_list():
+    return list(get_lookup_refresher().get()[1])
 
+
+def query_language_list():
     sql_query = f"""
                 SELECT display_language
                 FROM `dataexploration-193817.user_data.language_max_level`
                 ;
                 """
-    rows_raw = bq_client.query(sql_query)
-    rows = [dict(row) for row in rows_raw]
-    if len(rows) == 0:
+    table = get_query_executor().query_arrow(sql_query)
+    if table.num_rows == 0:
         return pd.DataFrame()
 
-    df = pd.DataFrame(rows)
-    df.drop_duplicates(inplace=True)
-    lang_list = np.array(df.values).flatten().tolist()
-    lang_list = [x.strip(" ") for x in lang_list]
+    languages = pc.unique(table.column("display_language"))
+    lang_list = pc.utf8_trim(languages, " ").to_pylist()
     return lang_list
 
 
-@st.cache_data(ttl="1d", show_spinner=False)
-def get_country_list():
-    countries_list = []
-    _, bq_client = get_gcp_credentials()
-
+def query_country_list():
     sql_query = f"""
                 SELECT country
                 FROM `dataexploration-193817.user_data.active_countries`
                 order by country asc
                 ;
                 """
-    rows_raw = bq_client.query(sql_query)
-    rows = [dict(row) for row in rows_raw]
-    if len(rows) == 0:
+    table = get_query_executor().query_arrow(sql_query)
+    if table.num_rows == 0:
         return pd.DataFrame()
 
-    df = pd.DataFrame(rows)
-    countries_list = np.array(df.values).flatten().tolist()
+    countries_list = table.column("country").to_pylist()
     return countries_list
 
 
@@ -189,92 +359,107 @@ def get_country_list():
 # to a single entry based on which combination took them the furthest in the game.
 # If its a tie, will take the first entry. The reference to duplicates are users
 # with multiple entries because of variations in these combinations
-
-@st.cache_data(ttl="1d", show_spinner=False)
+#
+# cr_user_id is integer-encoded once across both frames and every step below is
+# an array operation on those codes:
+#
+#   - best progress row per user: one stable lexsort on (cr_user_id order,
+#     level completed, max level, event rank) and the first row of each run
+#   - app launch: the user's best language is looked up by code, duplicate
+#     user_pseudo_id rows are dropped and one row per user is added back
+#
+# The result is identical, rows, order and index, to the original sort / merge
+# implementation kept in check_single_language.py, which compares the two.
+
+@versioned_cache(enabled=False)  # runs once per build_user_dataset
 def clean_cr_users_to_single_language(df_app_launch, df_cr_users):
-
-    # ✅  Identify and remove all duplicates from df_app_launch, but SAVE them for later
-    duplicate_user_ids = df_app_launch[df_app_launch.duplicated(subset='user_pseudo_id', keep=False)]
-    df_app_launch = df_app_launch[~df_app_launch["cr_user_id"].isin(duplicate_user_ids["cr_user_id"])]
-
-    # ✅  Get list of users that had duplicates
-    unique_duplicate_ids = duplicate_user_ids['cr_user_id'].unique().tolist()
-
-    # ✅  Define event ranking of the funnel
-    event_order = ["download_completed", "tapped_start", "selected_level", "puzzle_completed", "level_completed"]
-    event_rank = {event: rank for rank, event in enumerate(event_order)}
-
-    # ✅  Ensure "furthest_event" has no missing values
-
-    df_cr_users["furthest_event"] = df_cr_users["furthest_event"].fillna("unknown")
- 
-    # ✅ Map event to numeric rank
-    df_cr_users["event_rank"] = df_cr_users["furthest_event"].map(event_rank)
-
-    # ✅ Flag whether event is "level_completed" - this means we switch to level number to determine furthest progress
-    df_cr_users["is_level_completed"] = df_cr_users["furthest_event"] == "level_completed"
-
-    # ✅ Ensure a single row per user across country & language
-    df_cr_users = df_cr_users.sort_values(["cr_user_id", "is_level_completed", "max_user_level", "event_rank"], 
-                                          ascending=[True, False, False, False])
-
-    df_cr_users = df_cr_users.drop_duplicates(subset=["cr_user_id"], keep="first")  # ✅ Keep only best progress row
-
-    # ✅ Ensure every user in df_cr_users has a matching row in df_app_launch
-    users_to_update = df_cr_users[["cr_user_id", "app_language", "country"]].merge(
-        df_app_launch[["cr_user_id", "app_language", "country"]],
-        on="cr_user_id",
-        how="left",
-        suffixes=("_cr", "_app")
-    )
-
-    # ✅ Find users where the `app_language` in df_app_launch does not match the selected best `app_language` from df_cr_users
-    language_mismatch = users_to_update[users_to_update["app_language_cr"] != users_to_update["app_language_app"]]
-    
-    if not language_mismatch.empty:
-
-        # ✅ Update df_app_launch to reflect the correct `app_language` from df_cr_users
-        df_app_launch.loc[df_app_launch["cr_user_id"].isin(language_mismatch["cr_user_id"]), "app_language"] = \
-            df_app_launch["cr_user_id"].map(df_cr_users.set_index("cr_user_id")["app_language"])
-
-    # ✅ Ensure all users with duplicates exist in df_cr_users
-    missing_users = set(unique_duplicate_ids) - set(df_cr_users["cr_user_id"])
-
-    # ✅ Add back the correct user rows in df_app_launch, ensuring **matching language & country**
-    users_to_add_back = duplicate_user_ids.merge(
-        df_cr_users[["cr_user_id", "app_language", "country"]],
-        on=["cr_user_id", "app_language", "country"],
-        how="left"  
+    n_app = len(df_app_launch)
+
+    # ✅ One integer code per cr_user_id (a missing id is a code of its own)
+    codes, ids = pd.factorize(
+        pd.concat([df_app_launch["cr_user_id"], df_cr_users["cr_user_id"]], ignore_index=True),
+        use_na_sentinel=False)
+    app_codes, cr_codes = codes[:n_app], codes[n_app:]
+    # Rank of each id in cr_user_id order (Arrow sorts strings by code point,
+    # like Python, missing last)
+    id_order = np.empty(len(ids), dtype=np.int64)
+    id_order[pc.sort_indices(pa.array(ids, from_pandas=True)).to_numpy()] = np.arange(len(ids))
+
+    # ✅ Map event to numeric rank, "unknown" when missing
+    event_rank = {event: rank for rank, event in enumerate(EVENT_ORDER)}
+    furthest_event = df_cr_users["furthest_event"].fillna("unknown")
+    df_cr_users = df_cr_users.assign(
+        furthest_event=furthest_event,
+        event_rank=furthest_event.map(event_rank),
+        is_level_completed=furthest_event == "level_completed",
     )
 
-    # ✅ Drop NaN values to ensure only valid rows are added back
-    users_to_add_back = users_to_add_back.dropna(subset=["app_language"])
+    # ✅ Best progress row per user: level_completed first, then highest level,
+    # then furthest event (missing values last), ties in row order
+    def descending(values):
+        values = -values.to_numpy(dtype="float64", na_value=np.nan)
+        values[np.isnan(values)] = np.inf
+        return values
+
+    order = np.lexsort((
+        descending(df_cr_users["event_rank"]),
+        descending(df_cr_users["max_user_level"]),
+        ~df_cr_users["is_level_completed"].to_numpy(dtype=bool),
+        id_order[cr_codes],
+    ))
+    sorted_codes = cr_codes[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    best = order[first]
+    df_cr_users = df_cr_users.iloc[best]
+    best_codes = cr_codes[best]
+
+    has_progress = np.zeros(len(ids), dtype=bool)
+    has_progress[best_codes] = True
+    best_language = np.empty(len(ids), dtype=object)
+    best_language[best_codes] = df_cr_users["app_language"].to_numpy(dtype=object)
+
+    # ✅ Users with a duplicated user_pseudo_id are removed and added back below
+    duplicate_rows = df_app_launch.duplicated(subset="user_pseudo_id", keep=False).to_numpy()
+    is_duplicate_user = np.zeros(len(ids), dtype=bool)
+    is_duplicate_user[app_codes[duplicate_rows]] = True
+    kept = ~is_duplicate_user[app_codes]
+
+    # ✅ Remaining app launch rows take the language of the user's best progress row
+    app_language = df_app_launch["app_language"].to_numpy(dtype=object, copy=True)
+    relabel = kept & has_progress[app_codes]
+    app_language[relabel] = best_language[app_codes[relabel]]
+    kept_rows = np.flatnonzero(kept)
+    kept_rows = kept_rows[~pd.Series(app_codes[kept_rows]).duplicated().to_numpy()]
+    restored = df_app_launch.assign(app_language=app_language).iloc[kept_rows]
+
+    # ✅ Add back one row per duplicated user: the first with a language,
+    # positioned (and labelled) by its place among the duplicate rows ...
+    duplicates = df_app_launch[duplicate_rows]
+    duplicate_codes = app_codes[duplicate_rows]
+    with_language = np.flatnonzero(duplicates["app_language"].notna().to_numpy())
+    with_language = with_language[~pd.Series(duplicate_codes[with_language]).duplicated().to_numpy()]
+    added = duplicates.iloc[with_language].set_axis(pd.Index(with_language), axis=0)
+
+    # ... or, for users without a progress row, a fallback first row
+    added_user = np.zeros(len(ids), dtype=bool)
+    added_user[duplicate_codes[with_language]] = True
+    fallback = np.flatnonzero(~has_progress[duplicate_codes])
+    fallback = fallback[~pd.Series(duplicate_codes[fallback]).duplicated().to_numpy()]
+    fallback = fallback[~added_user[duplicate_codes[fallback]]]
+
+    df_app_launch = pd.concat([restored, added, duplicates.iloc[fallback]])
+    app_launch_codes = np.concatenate([app_codes[kept_rows], duplicate_codes[with_language], duplicate_codes[fallback]])
 
-    # ✅ If any users are still missing, add a fallback row for them
-    fallback_users = duplicate_user_ids[duplicate_user_ids["cr_user_id"].isin(missing_users)]
-    fallback_users = fallback_users.drop_duplicates(subset="cr_user_id", keep="first")
-
-    # Append the fallback users
-    users_to_add_back = pd.concat([users_to_add_back, fallback_users])
-
-    # ✅ Deduplicate to ensure only one row per cr_user_id is added back
-    users_to_add_back = users_to_add_back.drop_duplicates(subset="cr_user_id", keep="first")
-
-    # ✅ Restore users into df_app_launch
-    df_app_launch = pd.concat([df_app_launch, users_to_add_back])
-
-    # ✅ Ensure df_app_launch has only unique cr_user_id
-
-    df_app_launch = df_app_launch.drop_duplicates(subset="cr_user_id", keep="first")
-    
     # This is a fix for a nasty bug where a user can have a different first_open in one dataframe vs the other.
     # Its because cr_app_launch is Curious Reader first open but cr_user_progress is FTM first_open
-    df_cr_users["first_open"] = df_cr_users["cr_user_id"].map(df_app_launch.set_index("cr_user_id")["first_open"])
+    first_open = pd.Series(df_app_launch["first_open"].to_numpy(), index=app_launch_codes)
+    df_cr_users = df_cr_users.assign(first_open=pd.Series(best_codes).map(first_open).to_numpy())
     return df_app_launch, df_cr_users
 
 
-def fix_date_columns(df, columns):
-    for col in columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors="coerce")
-    return df
+def to_timestamp(values):
+    """Arrow dates as naive ns timestamps, what pd.to_datetime(errors="coerce") gives."""
+    if pa.types.is_date(values.type) or (pa.types.is_timestamp(values.type) and values.type.tz is None):
+        return values.cast(pa.timestamp("ns"))
+    return pa.array(pd.to_datetime(values.to_pandas(), errors="coerce"))
@@ -0,0 +1,82 @@
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+# st.cache_data hashes the content of every DataFrame argument on every call,
+# which for the multi-million-row user frames costs more than most of the
+# functions it wraps.  versioned_cache keys on cheap fingerprints instead:
+#
+#   - the first argument is a dataset with a `version` attribute (UserDataset),
+#     identifying its content without looking at it
+#   - the remaining arguments are the filter selections, normalised to tuples
+#
+# so a lookup costs the same whatever the data size.  Entries are shared by all
+# sessions in the process and evicted least-recently-used; a new data version
+# simply stops matching the old entries.
+#
+# Functions that are cheaper to recompute than to cache opt out explicitly with
+# @versioned_cache(enabled=False), which documents the decision and leaves the
+# function uncached.  CL_DISABLE_VERSIONED_CACHE=1 turns every cache off, for
+# benchmarking.
+
+DISABLE_ENV = "CL_DISABLE_VERSIONED_CACHE"
+
+
+def fingerprint(dataset):
+    try:
+        return dataset.version
+    except AttributeError:
+        raise TypeError(
+            f"versioned_cache needs a dataset with a version as first argument, got {type(dataset).__name__}"
+        ) from None
+
+
+def freeze(value):
+    """Hashable form of a filter argument (lists of selections become tuples)."""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    hash(value)
+    return value
+
+
+def versioned_cache(maxsize=128, enabled=True):
+    def decorator(func):
+        if not enabled:
+            return func
+
+        entries = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(dataset, *args, **kwargs):
+            if os.environ.get(DISABLE_ENV):
+                return func(dataset, *args, **kwargs)
+
+            key = (fingerprint(dataset), freeze(args), freeze(kwargs))
+            with lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key]
+
+            result = func(dataset, *args, **kwargs)
+
+            with lock:
+                entries[key] = result
+                entries.move_to_end(key)
+                while len(entries) > maxsize:
+                    entries.popitem(last=False)
+            return result
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
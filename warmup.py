@@ -0,0 +1,217 @@
+"""
+Start the dashboard with its data already loaded.
+
+`streamlit run main.py` only fills the process-wide caches when the first
+visitor's rerun calls init_data(), so after every deploy or scale-out the first
+users wait through the whole cold load.  This entry point runs the Streamlit
+server in-process (the caches are per process) and, alongside it:
+
+  - imports the page's modules, loads the campaign data, the user data and
+    the selector lists through their Refreshers (refresher.py) and builds the
+    campaign dimension
+  - unless --no-precompute, runs the home page computations once for the
+    default selections over the common date ranges (All time and the
+    presets), which fills get_event_summary's cache
+  - serves a readiness check on --ready-port (CL_READY_PORT, default 8081):
+
+        GET /healthz  200 while the process is up
+        GET /ready    503 until the data is loaded and the Streamlit server
+                      accepts connections on --port, then 200
+
+    with the warm-up status as JSON, for a load balancer to poll.
+
+    python warmup.py --port 8080
+    CL_DATA_BACKEND=local CL_DATA_DIR=local_data python warmup.py
+
+A visitor arriving before the data is loaded waits on the same load rather
+than starting another one.  If the warm-up fails, /ready keeps answering 503
+with the error and the first rerun retries the load as before.
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+READY_PORT_ENV = "CL_READY_PORT"
+DEFAULT_READY_PORT = 8081
+
+# Modules the first render imports, some only inside the functions that use
+# them (see check_import_time.py)
+PAGE_MODULES = ["st_pages", "millify", "ui_widgets", "ui_components", "streamlit_option_menu"]
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+class WarmupStatus:
+    """What /ready reports, updated by the warm-up thread."""
+
+    def __init__(self):
+        self.state = STARTING
+        self.started = dt.datetime.now(dt.timezone.utc)
+        self.details = {}
+        self._lock = threading.Lock()
+
+    def update(self, state=None, **details):
+        with self._lock:
+            self.state = state or self.state
+            self.details.update(details)
+
+    def report(self):
+        with self._lock:
+            return {"status": self.state, "started": self.started.isoformat(), **self.details}
+
+
+def common_dateranges():
+    """The date ranges of the home page's default and preset selections."""
+    import ui_widgets as ui
+    from settings import default_daterange
+
+    dateranges = [ui.convert_date_to_range(None, "All time")]
+    dateranges += [ui.calculate_preset_dates(preset) for preset in ui.presets]
+    for daterange in dateranges:
+        # As home.py clamps them
+        if daterange[0] < default_daterange[0]:
+            daterange[0] = default_daterange[0]
+    return dateranges
+
+
+def precompute(user_dataset, campaign_data, dateranges):
+    """
+    The home page computations for the default selections over dateranges.
+    Only get_event_summary keeps its results; the others are cheap per rerun
+    and are run here so their first call is not a visitor's.
+    """
+    from cohort_cube import cohort_totals
+    from metrics import get_event_summary, get_user_cohort_df
+
+    for daterange in dateranges:
+        cohort_totals(user_dataset.cohort_cube, daterange=daterange)
+        get_user_cohort_df(session_df=user_dataset.app_launch_index, daterange=daterange)
+        campaign_data.cost_index.rollup(daterange)
+        get_event_summary(user_dataset, daterange, ["All"], ["All"], source_id=None)
+
+
+def server_address(port=None):
+    """(host, port) to reach the Streamlit server on, port defaulting to server.port."""
+    from streamlit import config
+
+    host = config.get_option("server.address")
+    if not host or host in ("0.0.0.0", "::"):
+        host = "127.0.0.1"
+    return host, port if port is not None else config.get_option("server.port")
+
+
+def wait_for_server(port=None, interval=0.2):
+    """Block until the Streamlit server accepts connections."""
+    while True:
+        try:
+            with socket.create_connection(server_address(port), timeout=1):
+                return
+        except OSError:
+            time.sleep(interval)
+
+
+def warm(status, precompute_filters=True, port=None):
+    """
+    Load everything a first rerun would, recording progress in status, and
+    report READY once the server on port (server.port when None) is up too.
+    """
+    import importlib
+    import settings
+    import telemetry
+    import users
+    from campaign_dimension import get_campaign_dimension
+
+    start = time.perf_counter()
+    try:
+        settings.initialize()
+        with telemetry.stage("warmup"):
+            for module in PAGE_MODULES:
+                importlib.import_module(module)
+            campaign_data = settings.get_campaign_refresher().get()
+            status.update(campaign_version=campaign_data.version)
+            user_dataset = users.get_user_data_refresher().get()
+            status.update(user_version=user_dataset.version)
+            users.get_lookup_refresher()
+            get_campaign_dimension(user_dataset.version, campaign_data.version, user_dataset, campaign_data)
+
+            if precompute_filters:
+                with telemetry.stage("warmup.precompute"):
+                    dateranges = common_dateranges()
+                    precompute(user_dataset, campaign_data, dateranges)
+                status.update(precomputed_dateranges=len(dateranges))
+    except Exception as e:
+        status.update(FAILED, error=f"{type(e).__name__}: {e}")
+        settings.get_logger().exception("Warm-up failed; the first rerun will load the data")
+        return
+    status.update(data_seconds=round(time.perf_counter() - start, 1))
+
+    # The data can be ready before bootstrap.run has bound the app port
+    wait_for_server(port)
+    status.update(READY, seconds=round(time.perf_counter() - start, 1))
+    settings.get_logger().info(f"Warm-up done in {time.perf_counter() - start:.1f}s")
+
+
+def readiness_server(status, port, host=""):
+    """HTTP server answering /healthz and /ready from status (not started)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if path == "/healthz":
+                code = 200
+            elif path == "/ready":
+                code = 200 if status.state == READY else 503
+            else:
+                self.send_error(404)
+                return
+            body = json.dumps(status.report()).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Polled every few seconds; keep it out of the logs
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, help="Streamlit server port (server.port)")
+    parser.add_argument("--ready-port", type=int, default=int(os.environ.get(READY_PORT_ENV, DEFAULT_READY_PORT)),
+                        help="port of the /healthz and /ready checks")
+    parser.add_argument("--no-precompute", action="store_true",
+                        help="only load the data, skip the common filter combinations")
+    args = parser.parse_args(argv)
+
+    status = WarmupStatus()
+    server = readiness_server(status, args.ready_port)
+    threading.Thread(target=server.serve_forever, name="readiness", daemon=True).start()
+    threading.Thread(target=warm, args=(status, not args.no_precompute, args.port), name="warmup",
+                     daemon=True).start()
+
+    from streamlit import config
+    from streamlit.web import bootstrap
+
+    # What `streamlit run main.py --server.port=...` does
+    flag_options = {"server_port": args.port, "server_headless": True}
+    config._main_script_path = MAIN_SCRIPT
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run(MAIN_SCRIPT, False, [], flag_options)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())